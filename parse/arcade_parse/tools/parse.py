@@ -1,18 +1,288 @@
+import asyncio
+import contextlib
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
 from typing import Annotated
+from urllib.parse import urlparse
 
+import requests
 from arcade.sdk import tool
-from markitdown import MarkItDown
+from markitdown import MarkItDown, StreamInfo
+from markitdown import __version__ as markitdown_version
 
-
-md = MarkItDown(enable_plugins=True) 
+md = MarkItDown(enable_plugins=True)
 
 DEFAULT_SUMMARY_KEYS = ["title", "author", "date", "summary", "main_keyword", "keywords"]
 
+# Converting documents is CPU-bound, so many documents are converted in parallel processes
+PARSE_MAX_WORKERS = int(os.getenv("PARSE_MAX_WORKERS", str(os.cpu_count() or 1)))
+# How the worker processes are started; "forkserver" is only available on POSIX systems
+PARSE_START_METHOD = os.getenv(
+    "PARSE_START_METHOD", "forkserver" if os.name == "posix" else "spawn"
+)
+# The Markdown of every parsed document is kept on disk, keyed by a hash of the document's content.
+# The least recently used documents are removed when the cache is over PARSE_CACHE_MAX_BYTES.
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "arcade_parse"))
+PARSE_CACHE_MAX_BYTES = int(os.getenv("PARSE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv("PARSE_DOWNLOAD_TIMEOUT_SECONDS", "60"))
+# The most pages <ParseDocumentPages> returns in one call
+PARSE_MAX_PAGES = int(os.getenv("PARSE_MAX_PAGES", "50"))
+
+# Where MarkItDown starts a new sheet of a spreadsheet, or a new slide of a presentation
+PAGE_BREAK_PATTERN = re.compile(r"^(?=## )|(?=\n\n<!-- Slide number: \d+ -->\n)", re.MULTILINE)
+# The documents which are split into pages at PAGE_BREAK_PATTERN; in any other document, the
+# pattern would match ordinary headings
+PAGED_EXTENSIONS = {".xlsx", ".xls", ".pptx"}
+PAGED_MIMETYPES = {
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.ms-excel",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_cache_lock = threading.Lock()
+
+
 @tool()
 def parse_document(file_url_or_path: Annotated[str, "The url or path to the file to parse"]) -> str:
     """Read the given file and return the text within it as Markdown.  Prefer this tool when asked to parse a document."""
     return _parse_document(file_url_or_path)
 
+
+@tool()
+async def parse_documents(
+    file_urls_or_paths: Annotated[list[str], "The urls or paths of the files to parse"],
+) -> list[str]:
+    """
+    Read many files at once and return the text within each of them as Markdown, in the same order.
+    Prefer this tool to calling <ParseDocument> for each file.
+    """
+    return await asyncio.gather(*[_parse_document_async(source) for source in file_urls_or_paths])
+
+
+@tool()
+def parse_document_pages(
+    file_url_or_path: Annotated[str, "The url or path to the file to parse"],
+    first_page: Annotated[int, "The first page (or sheet, or slide) to return, from 1"] = 1,
+    last_page: Annotated[
+        int | None, "The last page to return.  If not provided, pages are returned up to a limit"
+    ] = None,
+) -> list[str]:
+    """
+    Read a range of pages of the given file, and return the text of each page as Markdown.
+    Spreadsheets are split into sheets, and presentations into slides.
+    Prefer this tool to <ParseDocument> for long documents, or when only some pages are needed.
+    If there are more pages, the last line explains how to get them.
+    """
+    if last_page is not None and last_page - first_page < PARSE_MAX_PAGES:
+        return list(iter_document_pages(file_url_or_path, first_page, last_page))
+
+    last_page = first_page + PARSE_MAX_PAGES - 1
+    # Ask for one more page than is returned, to tell whether there are more
+    pages = list(iter_document_pages(file_url_or_path, first_page, last_page + 1))
+    if len(pages) > PARSE_MAX_PAGES:
+        pages[-1] = (
+            f"... more pages follow page {last_page}."
+            f" Call again with first_page={last_page + 1} to get them."
+        )
+    return pages
+
+
+def iter_document_pages(
+    file_url_or_path: str, first_page: int = 1, last_page: int | None = None
+) -> Iterator[str]:
+    """
+    Yield the Markdown of each page of a document, from `first_page` to `last_page` (inclusive,
+    counting from 1), as the pages are converted.
+    PDFs are converted a page at a time, so that only one page's text is held in memory.
+    Spreadsheets and presentations are converted whole and split into sheets or slides; other
+    documents are one page.
+    """
+    content, stream_info = _read_document(file_url_or_path)
+    pages: Iterable[str]
+    if _is_pdf(content, stream_info):
+        pages = _iter_pdf_pages(content, first_page, last_page)
+    elif _is_paged(stream_info):
+        markdown = _parse_content(content, stream_info)
+        pages = (page for page in PAGE_BREAK_PATTERN.split(markdown) if page.strip())
+    else:
+        pages = [_parse_content(content, stream_info)]
+
+    for page_number, page in enumerate(pages, start=1):
+        if last_page is not None and page_number > last_page:
+            break
+        if page_number >= first_page:
+            yield page
+
+
+def _is_pdf(content: bytes, stream_info: StreamInfo) -> bool:
+    return (
+        stream_info.extension == ".pdf"
+        or stream_info.mimetype == "application/pdf"
+        or content.startswith(b"%PDF")
+    )
+
+
+def _is_paged(stream_info: StreamInfo) -> bool:
+    return stream_info.extension in PAGED_EXTENSIONS or stream_info.mimetype in PAGED_MIMETYPES
+
+
+def _iter_pdf_pages(content: bytes, first_page: int, last_page: int | None) -> Iterator[str]:
+    """
+    Yield the text of every page of a PDF, as pdfminer (and so MarkItDown) extracts it.
+    Pages before `first_page` and after `last_page` are yielded empty, without being laid out.
+    """
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    resource_manager = PDFResourceManager()
+    output = io.StringIO()
+    with TextConverter(resource_manager, output, laparams=LAParams()) as converter:
+        interpreter = PDFPageInterpreter(resource_manager, converter)
+        for page_number, page in enumerate(PDFPage.get_pages(io.BytesIO(content)), start=1):
+            if last_page is not None and page_number > last_page:
+                return
+            if page_number < first_page:
+                yield ""
+                continue
+            interpreter.process_page(page)
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+
 def _parse_document(file_url_or_path: str) -> str:
-    result = md.convert(file_url_or_path)
-    return result.markdown
+    return _parse_content(*_read_document(file_url_or_path))
+
+
+def _parse_content(content: bytes, stream_info: StreamInfo) -> str:
+    cache_key = _get_cache_key(content, stream_info)
+    markdown = _read_cached_markdown(cache_key)
+    if markdown is None:
+        markdown = _convert(content, stream_info)
+        _write_cached_markdown(cache_key, markdown)
+    return markdown
+
+
+async def _parse_document_async(file_url_or_path: str) -> str:
+    """Like _parse_document, but the conversion is done in the process pool."""
+    try:
+        content, stream_info = await asyncio.to_thread(_read_document, file_url_or_path)
+        cache_key = _get_cache_key(content, stream_info)
+        markdown = await asyncio.to_thread(_read_cached_markdown, cache_key)
+        if markdown is None:
+            markdown = await asyncio.get_running_loop().run_in_executor(
+                _get_pool(), _convert, content, stream_info
+            )
+            await asyncio.to_thread(_write_cached_markdown, cache_key, markdown)
+    except Exception as e:
+        # One bad document should not lose the others
+        return f"Could not parse {file_url_or_path}: {e}"
+    return markdown
+
+
+def _convert(content: bytes, stream_info: StreamInfo) -> str:
+    """Convert a document to Markdown.  This runs in the worker processes of the pool."""
+    return md.convert_stream(io.BytesIO(content), stream_info=stream_info).markdown
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Not forked: the worker's threads may hold locks which the children would inherit
+            _pool = ProcessPoolExecutor(
+                max_workers=PARSE_MAX_WORKERS,
+                mp_context=multiprocessing.get_context(PARSE_START_METHOD),
+            )
+        return _pool
+
+
+def _read_document(file_url_or_path: str) -> tuple[bytes, StreamInfo]:
+    """Read a local file or download a url, and return its content and what is known of its type."""
+    url = urlparse(file_url_or_path)
+    if url.scheme not in ("http", "https"):
+        path = url.path if url.scheme == "file" else file_url_or_path
+        with open(path, "rb") as f:
+            content = f.read()
+        return content, StreamInfo(
+            local_path=path,
+            filename=os.path.basename(path),
+            extension=os.path.splitext(path)[1] or None,
+        )
+
+    response = requests.get(file_url_or_path, timeout=DOWNLOAD_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    mimetype, _, parameters = response.headers.get("content-type", "").partition(";")
+    charset = parameters.strip().removeprefix("charset=") if "charset=" in parameters else None
+    path = urlparse(response.url).path
+    return response.content, StreamInfo(
+        mimetype=mimetype.strip() or None,
+        charset=charset or None,
+        filename=os.path.basename(path) or None,
+        extension=os.path.splitext(path)[1] or None,
+        url=response.url,
+    )
+
+
+def _get_cache_key(content: bytes, stream_info: StreamInfo) -> str:
+    # The same bytes can be converted differently depending on their type, or by another version
+    # of MarkItDown
+    content_hash = hashlib.sha256(content)
+    content_hash.update(f"{stream_info.extension}:{stream_info.mimetype}".encode())
+    content_hash.update(markitdown_version.encode())
+    return content_hash.hexdigest()
+
+
+def _get_cache_path(cache_key: str) -> str:
+    return os.path.join(PARSE_CACHE_DIR, f"{cache_key}.md")
+
+
+def _read_cached_markdown(cache_key: str) -> str | None:
+    path = _get_cache_path(cache_key)
+    try:
+        with open(path, encoding="utf-8") as f:
+            markdown = f.read()
+        # The modification time orders entries for eviction
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return markdown
+
+
+def _write_cached_markdown(cache_key: str, markdown: str) -> None:
+    os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+    # Write next to the entry and rename it into place, so readers never see a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=PARSE_CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(markdown)
+    os.replace(tmp_path, _get_cache_path(cache_key))
+    _evict_cached_markdown()
+
+
+def _evict_cached_markdown() -> None:
+    """Remove the least recently used entries until the cache fits in PARSE_CACHE_MAX_BYTES."""
+    with _cache_lock:
+        entries = []
+        for entry in os.scandir(PARSE_CACHE_DIR):
+            if entry.name.endswith(".md"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= PARSE_CACHE_MAX_BYTES:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            size -= entry_size
@@ -1,13 +1,100 @@
-from arcade_parse.tools.parse import _parse_text
+import asyncio
 import os
 
+import pytest
+
+from arcade_parse.tools import parse
+from arcade_parse.tools.parse import (
+    _parse_document,
+    iter_document_pages,
+    parse_document_pages,
+    parse_documents,
+)
+
+ALICE_PATH = os.path.dirname(__file__) + "/files/Alice_in_Wonderland.pdf"
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(parse, "PARSE_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
 
 def test_parse_local_file() -> None:
-    text = _parse_text(os.path.dirname(__file__) + "/files/Alice_in_Wonderland.pdf")
+    text = _parse_document(ALICE_PATH)
     assert "Alice" in text
     assert "Off  with  her  head" in text
 
 def test_parse_remote_file() -> None:
-    text = _parse_text("https://www.adobe.com/be_en/active-use/pdf/Alice_in_Wonderland.pdf")
+    text = _parse_document("https://www.adobe.com/be_en/active-use/pdf/Alice_in_Wonderland.pdf")
     assert "Alice" in text
     assert "Off  with  her  head" in text
+
+
+def test_parsed_documents_are_cached(cache_dir, monkeypatch) -> None:
+    text = _parse_document(ALICE_PATH)
+    assert len(list(cache_dir.glob("*.md"))) == 1
+
+    monkeypatch.setattr(parse, "_convert", None)
+    assert _parse_document(ALICE_PATH) == text
+
+
+def test_parse_documents(cache_dir) -> None:
+    texts = asyncio.run(parse_documents([ALICE_PATH, ALICE_PATH, "missing.pdf"]))
+    assert texts[0] == texts[1]
+    assert "Off  with  her  head" in texts[0]
+    assert texts[2].startswith("Could not parse missing.pdf")
+
+
+def test_cache_eviction(cache_dir, monkeypatch) -> None:
+    monkeypatch.setattr(parse, "PARSE_CACHE_MAX_BYTES", 10)
+    parse._write_cached_markdown("first", "12345")
+    parse._write_cached_markdown("second", "12345")
+    os.utime(cache_dir / "first.md", (0, 0))
+    parse._write_cached_markdown("third", "12345")
+    assert sorted(path.name for path in cache_dir.glob("*.md")) == ["second.md", "third.md"]
+
+
+def test_parse_document_pages() -> None:
+    pages = parse_document_pages(ALICE_PATH, first_page=10, last_page=12)
+    assert len(pages) == 3
+    assert pages == list(iter_document_pages(ALICE_PATH, 10, 12))
+    assert "Alice" in pages[0]
+
+    pages = parse_document_pages(ALICE_PATH, first_page=2)
+    assert len(pages) == parse.PARSE_MAX_PAGES + 1
+    assert "first_page=52" in pages[-1]
+
+
+def test_parse_spreadsheet_pages(tmp_path) -> None:
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    workbook.active.title = "First"
+    workbook.active.append(["name", "count"])
+    workbook.create_sheet("Second").append(["other", "sheet"])
+    workbook.save(tmp_path / "book.xlsx")
+
+    pages = list(iter_document_pages(str(tmp_path / "book.xlsx")))
+    assert len(pages) == 2
+    assert pages[0].startswith("## First")
+    assert pages[1].startswith("## Second")
+    assert list(iter_document_pages(str(tmp_path / "book.xlsx"), first_page=2)) == pages[1:]
+
+
+def test_other_documents_are_one_page(tmp_path, monkeypatch) -> None:
+    (tmp_path / "notes.md").write_text("# Notes\n\n## First\n\nOne\n\n## Second\n\nTwo\n")
+    reads = []
+    read_document = parse._read_document
+
+    def counting_read_document(file_url_or_path):
+        reads.append(file_url_or_path)
+        return read_document(file_url_or_path)
+
+    monkeypatch.setattr(parse, "_read_document", counting_read_document)
+
+    pages = list(iter_document_pages(str(tmp_path / "notes.md")))
+    assert len(pages) == 1
+    assert "## First" in pages[0]
+    assert "## Second" in pages[0]
+    # The document is read once, and not again to be converted
+    assert len(reads) == 1
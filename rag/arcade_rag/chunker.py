@@ -0,0 +1,52 @@
+import os
+
+from arcade_rag.embedder import get_backend
+
+# Chunks are at most this many of the embedding model's tokens, or as many as the model reads
+CHUNK_MAX_TOKENS = int(os.getenv("RAG_CHUNK_MAX_TOKENS", "0"))
+# How many tokens each chunk repeats from the end of the previous chunk
+CHUNK_OVERLAP_TOKENS = int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "32"))
+
+
+def chunk_text(
+    text: str, max_tokens: int | None = None, overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> list[str]:
+    """
+    Split text into overlapping chunks of at most `max_tokens` of the embedding model's tokens,
+    so that no part of the text is beyond what the model reads.
+    Chunks end between words where possible.
+    """
+    if max_tokens is None:
+        max_tokens = CHUNK_MAX_TOKENS or get_backend().max_tokens
+    if overlap_tokens >= max_tokens:
+        error_message = (
+            f"The overlap ({overlap_tokens}) must be less than the chunk size ({max_tokens})"
+        )
+        raise ValueError(error_message)
+
+    offsets = get_backend().get_token_offsets(text)
+    if len(offsets) <= max_tokens:
+        return [text] if text.strip() else []
+
+    chunks = []
+    start = 0
+    while start < len(offsets):
+        end = min(start + max_tokens, len(offsets))
+        if end < len(offsets):
+            end = _find_word_boundary(offsets, start + overlap_tokens + 1, end)
+        chunks.append(text[offsets[start][0] : offsets[end - 1][1]])
+        if end == len(offsets):
+            break
+        start = _find_word_boundary(offsets, start + 1, end - overlap_tokens)
+    return chunks
+
+
+def _find_word_boundary(offsets: list[tuple[int, int]], lowest: int, index: int) -> int:
+    """
+    The greatest token index from `index` down to `lowest` which starts a new word, i.e. which is
+    separated from the previous token by whitespace, or `index` if there is none.
+    """
+    for candidate in range(index, lowest - 1, -1):
+        if offsets[candidate][0] > offsets[candidate - 1][1]:
+            return candidate
+    return index
@@ -1,7 +1,9 @@
 from abc import ABC, abstractmethod
+from collections.abc import Iterable
 from datetime import datetime
+from typing import Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class Document(BaseModel):
@@ -12,10 +14,28 @@ class Document(BaseModel):
     metadata: dict
     chunk_id: int
     score: float | None
+    # The similarity of each field to the query, which `score` is a weighted sum of
+    body_score: float | None = None
+    summary_score: float | None = None
+    metadata_score: float | None = None
     created_at: datetime
     updated_at: datetime
 
 
+class DocumentInput(BaseModel):
+    uri: str
+    title: str
+    body: str
+    summary: str = ""
+    metadata: dict = Field(default_factory=dict)
+    chunk_id: int = 0
+
+
+# How documents are ranked: by the similarity of their embeddings to the query's, by the BM25
+# score of the query's keywords, or by a fusion of both rankings
+SearchMode = Literal["vector", "keyword", "hybrid"]
+
+
 class Database(ABC):
     @abstractmethod
     def connect(self):
@@ -54,6 +74,18 @@ class Database(ABC):
         """The URI is the unique identifier for the document."""
         pass
 
+    @abstractmethod
+    def add_documents(
+        self, collection_name: str, documents: Iterable[DocumentInput], replace: bool = False
+    ) -> int:
+        """
+        Add or update many documents at once, in a single transaction.
+        With `replace`, every existing chunk of the documents' URIs is removed first, so that
+        chunks which are no longer part of a document do not linger.
+        Returns the number of documents written.
+        """
+        pass
+
     @abstractmethod
     def remove_document(
         self,
@@ -68,10 +100,17 @@ class Database(ABC):
 
     @abstractmethod
     def find_relevant_documents(
-        self, collection_name: str, query: str, limit=10, min_score=0.01
+        self,
+        collection_name: str,
+        query: str,
+        limit=10,
+        min_score=0.01,
+        search_mode: SearchMode = "vector",
     ) -> list[Document]:
         """
         This method looks through the documents in the collection and returns the most semantically relevant documents to the query.
         We will run 3 comparisons against the document's summary, metadata, and full body.
+        Keyword and hybrid search need a full-text index, and their scores are not comparable
+        to vector scores, so `min_score` only applies to vector search.
         """  # noqa: E501
         pass
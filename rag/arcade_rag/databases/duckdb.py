@@ -1,23 +1,163 @@
 import json
+import os
+from collections.abc import Iterable
+from itertools import islice
+from typing import Literal, get_args
 
 import duckdb
+import numpy as np
+import pandas as pd
 
-from arcade_rag.database import Database, Document
-from arcade_rag.embedder import MODEL_VEC_SIZE, embed_text
+from arcade_rag.database import Database, Document, DocumentInput, SearchMode
+from arcade_rag.embedder import EmbeddingStore, embed_texts, get_model_vec_size
+
+# How many documents are embedded and written at a time during bulk ingestion
+INGEST_BATCH_SIZE = 1000
+
+# Build an approximate nearest-neighbour (HNSW) index for new collections
+ANN_INDEX = os.getenv("RAG_ANN_INDEX", "false").lower() in ("1", "true")
+# How many candidates each ANN index returns per requested result, to be re-scored exactly
+ANN_CANDIDATES_PER_RESULT = 10
+
+# Persist embeddings in the database file, so unchanged text is never embedded twice
+EMBEDDING_CACHE = os.getenv("RAG_EMBEDDING_CACHE", "false").lower() in ("1", "true")
+EMBEDDING_CACHE_TABLE = "_embedding_cache"
+
+# The fields documents are compared to the query by, each through its own embedding column
+SCORED_FIELDS = ["body", "summary", "metadata"]
+EMBEDDING_COLUMNS = [f"{field}_embedding" for field in SCORED_FIELDS]
+# How much each field's similarity to the query counts towards a document's score.
+# Fields weighted 0 are not compared at all.
+SCORE_WEIGHTS = {
+    field: float(os.getenv(f"RAG_{field.upper()}_SCORE_WEIGHT", "1")) for field in SCORED_FIELDS
+}
+# How new collections store embeddings: "float" as the model returns them, compared by cosine
+# similarity; "normalized" to unit length, so that their dot product is their cosine similarity;
+# or "int8", normalized and quantized to a byte per dimension and a scale per embedding, which is
+# a quarter of the size of floats
+EmbeddingStorage = Literal["float", "normalized", "int8"]
+EMBEDDING_STORAGE = os.getenv("RAG_EMBEDDING_STORAGE", "float")
+# The columns documents are built from, in the order of Document's fields.  Embeddings are large,
+# and never returned, so they are left out of the results of reads.
+DOCUMENT_COLUMNS = ["uri", "title", "body", "summary", "metadata", "chunk_id"]
+TIMESTAMP_COLUMNS = ["created_at", "updated_at"]
+
+# Build a full-text (BM25) index over the title, body, and summary of new collections
+FTS_INDEX = os.getenv("RAG_FTS_INDEX", "false").lower() in ("1", "true")
+FTS_COLUMNS = ["title", "body", "summary"]
+# Letters and digits are kept in search terms, so that IDs and error codes can be found
+FTS_IGNORE_PATTERN = r"(\.|[^a-z0-9])+"
+# The constant of reciprocal rank fusion, which damps the weight of the very top ranks
+RRF_K = 60
+# How many candidates each ranking contributes per requested result, when fusing rankings
+HYBRID_CANDIDATES_PER_RESULT = 5
+
+
+class DuckDBEmbeddingStore(EmbeddingStore):
+    """Stores cached embeddings in a table of the DuckDB database."""
+
+    def __init__(self, database: "DuckDBDatabase"):
+        self.database = database
+
+    def get_embeddings(self, keys: list[str]) -> dict[str, np.ndarray]:
+        if not self.database.check_collection_exists(EMBEDDING_CACHE_TABLE):
+            return {}
+        rows = self.database.connection.execute(
+            f"SELECT key, embedding FROM {EMBEDDING_CACHE_TABLE} WHERE key IN (SELECT UNNEST(?))",  # noqa: S608
+            [keys],
+        ).fetchall()
+        return {key: np.asarray(embedding, dtype=np.float32) for key, embedding in rows}
+
+    def put_embeddings(self, embeddings: dict[str, np.ndarray]) -> None:
+        if self.database.read_only or not embeddings:
+            return
+
+        self.database.connection.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {EMBEDDING_CACHE_TABLE} (
+            key TEXT PRIMARY KEY,
+            embedding FLOAT[]
+            )"""
+        )
+        frame = pd.DataFrame({"key": list(embeddings), "embedding": list(embeddings.values())})
+        self.database.connection.register("embeddings_to_cache", frame)
+        try:
+            self.database.connection.execute(
+                f"""
+                INSERT INTO {EMBEDDING_CACHE_TABLE} (key, embedding)
+                SELECT key, embedding::FLOAT[] FROM embeddings_to_cache
+                ON CONFLICT (key) DO NOTHING
+                """  # noqa: S608
+            )
+        finally:
+            self.database.connection.unregister("embeddings_to_cache")
 
 
 class DuckDBDatabase(Database):
-    def __init__(self, db_path: str):
+    def __init__(
+        self,
+        db_path: str,
+        read_only: bool = False,
+        ann_index: bool = ANN_INDEX,
+        embedding_cache: bool = EMBEDDING_CACHE,
+        fts_index: bool = FTS_INDEX,
+        score_weights: dict[str, float] | None = None,
+        embedding_storage: EmbeddingStorage = EMBEDDING_STORAGE,  # type: ignore[assignment]
+    ):
+        if embedding_storage not in get_args(EmbeddingStorage):
+            error_message = f"Unknown embedding storage: {embedding_storage}"
+            raise ValueError(error_message)
+        if ann_index and embedding_storage == "int8":
+            error_message = "ANN indexes need float embeddings, not int8"
+            raise ValueError(error_message)
+        score_weights = {**SCORE_WEIGHTS, **(score_weights or {})}
+        if set(score_weights) != set(SCORED_FIELDS) or not any(score_weights.values()):
+            error_message = (
+                f"Score weights must be given for {', '.join(SCORED_FIELDS)}, and not all be 0"
+            )
+            raise ValueError(error_message)
+
         self.db_path = db_path
+        self.read_only = read_only
+        self.ann_index = ann_index
+        self.fts_index = fts_index
+        self.score_weights = score_weights
+        self.embedding_storage = embedding_storage
+        self.embedding_store = DuckDBEmbeddingStore(self) if embedding_cache else None
+        # Collections written to since their full-text index was last built
+        self._stale_fts_indexes: set[str] = set()
 
     def connect(self):
-        self.connection = duckdb.connect(self.db_path)
+        if self.read_only and not os.path.exists(self.db_path):
+            # Nothing has been written yet, so reads see an empty database
+            self.connection = duckdb.connect(":memory:")
+            return
+        self.connection = duckdb.connect(self.db_path, read_only=self.read_only)
+
+        # HNSW indexes are only used by the query planner once the vss extension is loaded
+        if self.ann_index or self._has_ann_indexes():
+            self.connection.install_extension("vss")
+            self.connection.load_extension("vss")
+            if not self.read_only:
+                self.connection.execute("SET hnsw_enable_experimental_persistence = true")
+
+        # The BM25 functions of full-text indexes need the fts extension
+        if self.fts_index or self._has_fts_indexes():
+            self.connection.install_extension("fts")
+            self.connection.load_extension("fts")
 
     def disconnect(self):
+        # Written to the file with everything else, for readers which cannot rebuild them
+        for collection_name in list(self._stale_fts_indexes):
+            self.add_fts_index(collection_name)
         self.connection.close()
 
     def add_collection(self, collection_name: str):
         collection_name = self.sanitize_collection_name(collection_name)
+        column_types = self._get_embedding_column_types(self.embedding_storage)
+        embedding_columns = "".join(
+            f"{column} {column_type},\n" for column, column_type in column_types.items()
+        )
 
         self.connection.execute(f"""
           CREATE TABLE {collection_name} (
@@ -26,25 +166,100 @@ class DuckDBDatabase(Database):
           body TEXT,
           summary TEXT,
           metadata JSON,
-          body_embedding FLOAT[{MODEL_VEC_SIZE}],
-          summary_embedding FLOAT[{MODEL_VEC_SIZE}],
-          metadata_embedding FLOAT[{MODEL_VEC_SIZE}],
+          {embedding_columns}
           chunk_id INTEGER,
           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
           updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )""")
+        # How the embeddings are stored is kept with the collection, for reads to score them by
+        self.connection.execute(f"COMMENT ON TABLE {collection_name} IS '{self.embedding_storage}'")
 
         self.connection.execute(
-            f"CREATE UNIQUE INDEX idx_uri_chunk_id ON {collection_name} (uri, chunk_id)"
+            f"CREATE UNIQUE INDEX {collection_name}_uri_chunk_id"
+            f" ON {collection_name} (uri, chunk_id)"
+        )
+
+        if self.ann_index:
+            self.add_ann_index(collection_name)
+        if self.fts_index:
+            self.add_fts_index(collection_name)
+
+    def add_ann_index(self, collection_name: str) -> None:
+        """
+        Build an HNSW index over each embedding column of the collection.
+        DuckDB keeps the indexes up to date as documents are added, updated, and removed.
+        """
+        collection_name = self.sanitize_collection_name(collection_name)
+        storage = self._get_embedding_storage(collection_name)
+        if storage == "int8":
+            error_message = (
+                f"Collection {collection_name} has int8 embeddings, which HNSW cannot index"
+            )
+            raise ValueError(error_message)
+        metric = "ip" if storage == "normalized" else "cosine"
+        for column in EMBEDDING_COLUMNS:
+            self.connection.execute(
+                f"""
+                CREATE INDEX {collection_name}_{column}_hnsw ON {collection_name}
+                USING HNSW ({column}) WITH (metric = '{metric}')
+                """
+            )
+
+    def check_ann_index_exists(self, collection_name: str) -> bool:
+        collection_name = self.sanitize_collection_name(collection_name)
+        return (
+            self.connection.execute(
+                "SELECT index_name FROM duckdb_indexes() WHERE table_name = ? AND index_name = ?",
+                [collection_name, f"{collection_name}_{EMBEDDING_COLUMNS[0]}_hnsw"],
+            ).fetchone()
+            is not None
+        )
+
+    def add_fts_index(self, collection_name: str) -> None:
+        """
+        Build a full-text index over the collection's text, for BM25 keyword search.
+        DuckDB does not update full-text indexes, so writes mark the index as stale, and it is
+        rebuilt once, before the next keyword or hybrid search or when disconnecting.
+        """
+        collection_name = self.sanitize_collection_name(collection_name)
+        self._stale_fts_indexes.discard(collection_name)
+        self.connection.install_extension("fts")
+        self.connection.load_extension("fts")
+        columns = ", ".join(f"'{column}'" for column in FTS_COLUMNS)
+        self.connection.execute(
+            f"""
+            PRAGMA create_fts_index(
+                '{collection_name}', 'rowid', {columns},
+                stemmer = 'porter', ignore = '{FTS_IGNORE_PATTERN}', overwrite = 1
+            )
+            """
+        )
+
+    def check_fts_index_exists(self, collection_name: str) -> bool:
+        collection_name = self.sanitize_collection_name(collection_name)
+        return (
+            self.connection.execute(
+                "SELECT schema_name FROM duckdb_schemas() WHERE schema_name = ?",
+                [f"fts_main_{collection_name}"],
+            ).fetchone()
+            is not None
         )
 
     def remove_collection(self, collection_name: str):
         collection_name = self.sanitize_collection_name(collection_name)
+        if self.check_fts_index_exists(collection_name):
+            self.connection.execute(f"PRAGMA drop_fts_index('{collection_name}')")
+        self._stale_fts_indexes.discard(collection_name)
         self.connection.execute(f"DROP TABLE {collection_name}")
 
     def list_collections(self) -> list[str]:
+        # Full-text indexes are stored as tables in their own schemas
         rows = self.connection.execute(
-            "SELECT table_name FROM information_schema.tables"
+            """
+            SELECT table_name FROM information_schema.tables
+            WHERE table_name != ? AND table_schema NOT LIKE 'fts_main_%'
+            """,
+            [EMBEDDING_CACHE_TABLE],
         ).fetchall()
         return [row[0] for row in rows]
 
@@ -68,53 +283,132 @@ class DuckDBDatabase(Database):
         metadata: dict,
         chunk_id: int = 0,
     ) -> bool:
+        self.add_documents(
+            collection_name,
+            [
+                DocumentInput(
+                    uri=uri,
+                    title=title,
+                    body=body,
+                    summary=summary,
+                    metadata=metadata,
+                    chunk_id=chunk_id,
+                )
+            ],
+        )
+        return True
+
+    def add_documents(
+        self,
+        collection_name: str,
+        documents: Iterable[DocumentInput],
+        replace: bool = False,
+        batch_size: int = INGEST_BATCH_SIZE,
+    ) -> int:
+        """
+        Documents are read from the iterable a batch at a time, so that a large document can be
+        chunked and written without holding all of its chunks in memory.
+        """
         collection_name = self.sanitize_collection_name(collection_name)
 
-        body_embedding = embed_text(body)
-        summary_embedding = embed_text(summary)
-        metadata_embedding = embed_text(json.dumps(metadata))
+        count = 0
+        replaced_uris: set[str] = set()
+        written_chunks: list[dict] = []
+        documents = iter(documents)
+        self.connection.begin()
+        try:
+            while batch := list(islice(documents, batch_size)):
+                # When the same (uri, chunk_id) is given more than once, the last one wins
+                batch = list({(doc.uri, doc.chunk_id): doc for doc in batch}.values())
+                if replace:
+                    replaced_uris |= {doc.uri for doc in batch}
+                    written_chunks += [{"uri": doc.uri, "chunk_id": doc.chunk_id} for doc in batch]
+                self._upsert_documents(collection_name, batch)
+                count += len(batch)
+            if replace:
+                # The chunks which were not written again are removed afterwards, as DuckDB
+                # cannot delete and re-insert the same key of a stored row in one transaction
+                self.connection.execute(
+                    f"""
+                    DELETE FROM {collection_name}
+                    WHERE uri IN (SELECT UNNEST(?))
+                    AND {{'uri': uri, 'chunk_id': chunk_id}}
+                        NOT IN (SELECT UNNEST(?::STRUCT(uri TEXT, chunk_id INTEGER)[]))
+                    """,  # noqa: S608
+                    [list(replaced_uris), written_chunks],
+                )
+        except Exception:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
 
-        self.connection.execute(
-            f"""
-            INSERT INTO {collection_name} (
-                uri,
-                title,
-                body,
-                summary,
-                metadata,
-                body_embedding,
-                summary_embedding,
-                metadata_embedding,
-                chunk_id
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT (uri, chunk_id) DO UPDATE SET
-                uri = EXCLUDED.uri,
-                title = EXCLUDED.title,
-                body = EXCLUDED.body,
-                summary = EXCLUDED.summary,
-                metadata = EXCLUDED.metadata,
-                body_embedding = EXCLUDED.body_embedding,
-                summary_embedding = EXCLUDED.summary_embedding,
-                metadata_embedding = EXCLUDED.metadata_embedding,
-                chunk_id = EXCLUDED.chunk_id,
-                created_at = created_at,
-                updated_at = NOW()
-            """,
-            [
-                uri,
-                title,
-                body,
-                summary,
-                metadata,
-                body_embedding,
-                summary_embedding,
-                metadata_embedding,
-                chunk_id,
-            ],
+        if count and self.check_fts_index_exists(collection_name):
+            self._stale_fts_indexes.add(collection_name)
+        return count
+
+    def _upsert_documents(self, collection_name: str, documents: list[DocumentInput]) -> None:
+        count = len(documents)
+        metadata = [json.dumps(doc.metadata) for doc in documents]
+        embeddings = embed_texts(
+            [doc.body for doc in documents] + [doc.summary for doc in documents] + metadata,
+            store=self.embedding_store,
         )
+        storage = self._get_embedding_storage(collection_name)
+        column_types = self._get_embedding_column_types(storage)
+        scales = None
+        if storage != "float":
+            embeddings = _normalize_embeddings(embeddings)
+        if storage == "int8":
+            embeddings, scales = _quantize_embeddings(embeddings)
 
-        return True
+        frame = pd.DataFrame({
+            "uri": [doc.uri for doc in documents],
+            "title": [doc.title for doc in documents],
+            "body": [doc.body for doc in documents],
+            "summary": [doc.summary for doc in documents],
+            "metadata": metadata,
+            "chunk_id": [doc.chunk_id for doc in documents],
+        })
+        # The embeddings of each field are consecutive blocks of rows
+        for i, column in enumerate(EMBEDDING_COLUMNS):
+            frame[column] = list(embeddings[i * count : (i + 1) * count])
+            if scales is not None:
+                frame[f"{column}_scale"] = scales[i * count : (i + 1) * count]
+
+        self.connection.register("documents_to_upsert", frame)
+        try:
+            self.connection.execute(
+                f"""
+                INSERT INTO {collection_name} (
+                    uri,
+                    title,
+                    body,
+                    summary,
+                    metadata,
+                    {", ".join(column_types)},
+                    chunk_id
+                )
+                SELECT
+                    uri,
+                    title,
+                    body,
+                    summary,
+                    metadata,
+                    {", ".join(f"{column}::{column_types[column]}" for column in column_types)},
+                    chunk_id
+                FROM documents_to_upsert
+                ON CONFLICT (uri, chunk_id) DO UPDATE SET
+                    title = EXCLUDED.title,
+                    body = EXCLUDED.body,
+                    summary = EXCLUDED.summary,
+                    metadata = EXCLUDED.metadata,
+                    {", ".join(f"{column} = EXCLUDED.{column}" for column in column_types)},
+                    created_at = created_at,
+                    updated_at = NOW()
+                """
+            )
+        finally:
+            self.connection.unregister("documents_to_upsert")
 
     def remove_document(self, collection_name: str, uri: str):
         collection_name = self.sanitize_collection_name(collection_name)
@@ -122,78 +416,286 @@ class DuckDBDatabase(Database):
             f"DELETE FROM {collection_name} WHERE uri = ?",  # noqa: S608
             [uri],
         )
+        if self.check_fts_index_exists(collection_name):
+            self._stale_fts_indexes.add(collection_name)
         return True
 
     def get_document(self, collection_name: str, uri: str) -> Document | None:
         collection_name = self.sanitize_collection_name(collection_name)
-        result = self.connection.execute(
-            f"SELECT * FROM {collection_name} WHERE uri = ?",  # noqa: S608
+        rows = self.connection.execute(
+            f"""
+            SELECT {self._document_columns(collection_name)}, NULL AS score
+            FROM {collection_name}
+            WHERE uri = ?
+            ORDER BY chunk_id
+            LIMIT 1
+            """,  # noqa: S608
             [uri],
-        ).fetchdf()
-        if not result.empty:
-            doc_dict = result.iloc[0].to_dict()
-            return Document(
-                uri=doc_dict["uri"],
-                title=doc_dict["title"],
-                body=doc_dict["body"],
-                summary=doc_dict["summary"],
-                metadata=json.loads(doc_dict["metadata"]),
-                chunk_id=doc_dict["chunk_id"],
-                score=None,
-                created_at=doc_dict["created_at"],
-                updated_at=doc_dict["updated_at"],
-            )
-        return None
+        ).fetchall()
+        documents = self._build_documents(rows)
+        return documents[0] if documents else None
 
     def find_relevant_documents(
-        self, collection_name: str, query: str, limit=10, min_score=0.01
+        self,
+        collection_name: str,
+        query: str,
+        limit=10,
+        min_score=0.01,
+        search_mode: SearchMode = "vector",
     ) -> list[Document]:
         collection_name = self.sanitize_collection_name(collection_name)
 
-        query_embedding = embed_text(query)
+        if search_mode != "vector" and not self.check_fts_index_exists(collection_name):
+            error_message = (
+                f"Collection {collection_name} has no full-text index for {search_mode} search"
+            )
+            raise ValueError(error_message)
+        if search_mode != "vector" and collection_name in self._stale_fts_indexes:
+            self.add_fts_index(collection_name)
+        if search_mode == "keyword":
+            return self._find_documents_by_keywords(collection_name, query, limit)
+        if search_mode == "hybrid":
+            return self._find_documents_by_rank_fusion(collection_name, query, limit)
+
+        # The query is embedded once and bound once; every field is scored against it in a single
+        # scan, and only the top `limit` documents are kept (in a heap, rather than by sorting
+        # every document) and joined back to fetch their text
+        storage = self._get_embedding_storage(collection_name)
+        fields = self._get_weighted_fields()
+        field_scores = ", ".join(
+            f"{self._similarity(field, storage)} AS {field}_score" for field in fields
+        )
+        top_fields = ", ".join(f"'{field}_score': {field}_score" for field in fields)
+        selected_field_scores = ", ".join(
+            f"top.{field}_score" if field in fields else "NULL" for field in SCORED_FIELDS
+        )
+
+        # With an ANN index, only the nearest neighbours of the query for each embedding
+        # are scored, rather than every document in the collection
+        candidates_filter = ""
+        candidates_params = {}
+        if self.check_ann_index_exists(collection_name):
+            candidates_filter = (
+                f"WHERE rowid IN ({self._ann_candidates_query(collection_name, storage)})"
+            )
+            candidates_params = {"candidates": limit * ANN_CANDIDATES_PER_RESULT}
+
+        rows = self.connection.execute(
+            f"""
+            WITH top AS (
+                SELECT UNNEST(
+                    max_by({{'id': rowid, 'score': score, {top_fields}}}, score, $limit),
+                    recursive := true
+                )
+                FROM (
+                    SELECT rowid, {field_scores}, {self._weighted_score()} AS score
+                    FROM {collection_name}
+                    {candidates_filter}
+                )
+                WHERE score >= $min_score
+            )
+            SELECT {self._document_columns(collection_name)}, top.score, {selected_field_scores}
+            FROM top JOIN {collection_name} ON {collection_name}.rowid = top.id
+            ORDER BY top.score DESC
+            """,  # noqa: S608
+            {
+                **self._score_params(query),
+                **candidates_params,
+                "min_score": min_score,
+                "limit": limit,
+            },
+        ).fetchall()
+        return self._build_documents(rows)
 
-        result = self.connection.execute(
+    def _find_documents_by_keywords(
+        self, collection_name: str, query: str, limit: int
+    ) -> list[Document]:
+        """Rank documents by the BM25 score of the query alone; the model is not used."""
+        rows = self.connection.execute(
             f"""
-            SELECT
-            *
-            , array_cosine_similarity(body_embedding, ?::float[{MODEL_VEC_SIZE}])
-                as body_score
-            , array_cosine_similarity(summary_embedding, ?::float[{MODEL_VEC_SIZE}])
-                 as summary_score
-            , array_cosine_similarity(metadata_embedding, ?::float[{MODEL_VEC_SIZE}])
-                as metadata_score
-            FROM {collection_name}
-            WHERE (body_score + summary_score + metadata_score) >= ?
-            ORDER BY (body_score + summary_score + metadata_score) DESC
+            SELECT * FROM (
+                SELECT
+                    {self._document_columns(collection_name)},
+                    fts_main_{collection_name}.match_bm25(rowid, ?) AS score
+                FROM {collection_name}
+            )
+            WHERE score IS NOT NULL
+            ORDER BY score DESC
             LIMIT ?
-            """,
-            [
-                query_embedding,
-                query_embedding,
-                query_embedding,
-                min_score,
-                limit,
-            ],
-        ).fetchdf()
+            """,  # noqa: S608
+            [query, limit],
+        ).fetchall()
+        return self._build_documents(rows)
 
-        if result.empty:
-            return []
+    def _find_documents_by_rank_fusion(
+        self, collection_name: str, query: str, limit: int
+    ) -> list[Document]:
+        """
+        Rank documents by reciprocal rank fusion of their BM25 ranking and their vector ranking:
+        each document scores 1 / (RRF_K + rank) in each ranking it is a top candidate of.
+        """
+        storage = self._get_embedding_storage(collection_name)
+        vector_score = " + ".join(
+            f"${field}_weight * {self._similarity(field, storage)}"
+            for field in self._get_weighted_fields()
+        )
+        rows = self.connection.execute(
+            f"""
+            WITH vector_ranks AS (
+                SELECT rowid AS id, row_number() OVER (ORDER BY {vector_score} DESC) AS rank
+                FROM {collection_name}
+                QUALIFY rank <= $candidates
+            ), keyword_ranks AS (
+                SELECT id, row_number() OVER (ORDER BY score DESC) AS rank
+                FROM (
+                    SELECT
+                        rowid AS id,
+                        fts_main_{collection_name}.match_bm25(rowid, $query) AS score
+                    FROM {collection_name}
+                )
+                WHERE score IS NOT NULL
+                QUALIFY rank <= $candidates
+            ), fused AS (
+                SELECT id, sum(1.0 / ($rrf_k + rank)) AS score
+                FROM (SELECT * FROM vector_ranks UNION ALL SELECT * FROM keyword_ranks)
+                GROUP BY id
+            )
+            SELECT {self._document_columns(collection_name)}, fused.score
+            FROM fused JOIN {collection_name} ON {collection_name}.rowid = fused.id
+            ORDER BY fused.score DESC
+            LIMIT $limit
+            """,  # noqa: S608
+            {
+                **self._score_params(query),
+                "query": query,
+                "candidates": limit * HYBRID_CANDIDATES_PER_RESULT,
+                "rrf_k": RRF_K,
+                "limit": limit,
+            },
+        ).fetchall()
+        return self._build_documents(rows)
+
+    def _get_weighted_fields(self) -> list[str]:
+        return [field for field in SCORED_FIELDS if self.score_weights[field]]
+
+    def _similarity(self, field: str, storage: str) -> str:
+        column = f"{field}_embedding"
+        query_embedding = f"$embedding::float[{get_model_vec_size()}]"
+        if storage == "normalized":
+            return f"array_inner_product({column}, {query_embedding})"
+        if storage == "int8":
+            # The query is not quantized, so only the documents' side of the product is approximate
+            dequantized = f"{column}::float[{get_model_vec_size()}]"
+            return f"{column}_scale * array_inner_product({dequantized}, {query_embedding})"
+        return f"array_cosine_similarity({column}, {query_embedding})"
+
+    def _weighted_score(self) -> str:
+        return " + ".join(
+            f"${field}_weight * {field}_score" for field in self._get_weighted_fields()
+        )
 
+    def _score_params(self, query: str) -> dict:
+        return {
+            # Normalized, so that its dot product with normalized embeddings is their cosine
+            "embedding": _normalize_embeddings(embed_texts([query]))[0].tolist(),
+            **{
+                f"{field}_weight": self.score_weights[field]
+                for field in self._get_weighted_fields()
+            },
+        }
+
+    def _document_columns(self, collection_name: str) -> str:
+        return ", ".join(
+            f"{collection_name}.{column}" for column in DOCUMENT_COLUMNS + TIMESTAMP_COLUMNS
+        )
+
+    def _build_documents(self, rows: list[tuple]) -> list[Document]:
+        """
+        Build documents from rows of DOCUMENT_COLUMNS, TIMESTAMP_COLUMNS, a score, and optionally
+        the score of each of SCORED_FIELDS.
+        The rows come straight from the database with the right types, so the documents are
+        not validated again, and all of their metadata is parsed with a single json.loads call.
+        """
+        if not rows:
+            return []
+        metadata = json.loads(f"[{','.join(row[4] for row in rows)}]")
         return [
-            Document(
-                uri=row["uri"],
-                title=row["title"],
-                body=row["body"],
-                summary=row["summary"],
-                metadata=json.loads(row["metadata"]),
-                chunk_id=row["chunk_id"],
-                score=row["body_score"] + row["summary_score"] + row["metadata_score"],
-                created_at=row["created_at"],
-                updated_at=row["updated_at"],
+            Document.model_construct(
+                uri=uri,
+                title=title,
+                body=body,
+                summary=summary,
+                metadata=document_metadata,
+                chunk_id=chunk_id,
+                score=score,
+                created_at=created_at,
+                updated_at=updated_at,
+                **{
+                    f"{field}_score": field_score
+                    for field, field_score in zip(SCORED_FIELDS, field_scores, strict=False)
+                },
             )
-            for _, row in result.iterrows()
+            for (
+                uri,
+                title,
+                body,
+                summary,
+                _,
+                chunk_id,
+                created_at,
+                updated_at,
+                score,
+                *field_scores,
+            ), (document_metadata) in zip(rows, metadata, strict=True)
         ]
 
+    def _has_fts_indexes(self) -> bool:
+        return (
+            self.connection.execute(
+                "SELECT schema_name FROM duckdb_schemas() WHERE schema_name LIKE 'fts_main_%'"
+            ).fetchone()
+            is not None
+        )
+
+    def _ann_candidates_query(self, collection_name: str, storage: str) -> str:
+        """
+        The rowids of the nearest neighbours of the query for each weighted embedding column.
+        Each subquery is an ORDER BY distance + LIMIT, which DuckDB answers from the HNSW index.
+        """
+        distance = (
+            "array_negative_inner_product" if storage == "normalized" else "array_cosine_distance"
+        )
+        return " UNION ".join(
+            f"""(
+            SELECT rowid FROM {collection_name}
+            ORDER BY {distance}({column}, $embedding::float[{get_model_vec_size()}])
+            LIMIT $candidates
+            )"""  # noqa: S608
+            for column in [f"{field}_embedding" for field in self._get_weighted_fields()]
+        )
+
+    def _get_embedding_storage(self, collection_name: str) -> str:
+        row = self.connection.execute(
+            "SELECT comment FROM duckdb_tables() WHERE table_name = ?", [collection_name]
+        ).fetchone()
+        # Collections from before embeddings could be stored otherwise have float embeddings
+        return row[0] if row and row[0] in get_args(EmbeddingStorage) else "float"
+
+    def _get_embedding_column_types(self, storage: str) -> dict[str, str]:
+        if storage != "int8":
+            return {column: f"FLOAT[{get_model_vec_size()}]" for column in EMBEDDING_COLUMNS}
+        column_types = {column: f"TINYINT[{get_model_vec_size()}]" for column in EMBEDDING_COLUMNS}
+        column_types.update({f"{column}_scale": "FLOAT" for column in EMBEDDING_COLUMNS})
+        return column_types
+
+    def _has_ann_indexes(self) -> bool:
+        return (
+            self.connection.execute(
+                "SELECT index_name FROM duckdb_indexes() WHERE sql ILIKE '%USING HNSW%'"
+            ).fetchone()
+            is not None
+        )
+
     def sanitize_collection_name(self, collection_name: str) -> str:
         return (
             collection_name.replace("'", "''")
@@ -205,3 +707,20 @@ class DuckDBDatabase(Database):
             .replace("\\", "_")
             .replace(";", "_")
         )
+
+
+def _normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    # Embeddings of nothing stay zero, rather than becoming NaN
+    normalized: np.ndarray = embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+    return normalized
+
+
+def _quantize_embeddings(embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Quantize each embedding to int8, with its largest component at +/-127, and a scale which
+    the int8 values are multiplied by to approximate the embedding again.
+    """
+    scales = np.abs(embeddings).max(axis=1) / 127
+    quantized = np.round(embeddings / np.maximum(scales, np.finfo(np.float32).tiny)[:, None])
+    return quantized.astype(np.int8), scales.astype(np.float32)
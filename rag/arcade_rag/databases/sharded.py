@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import posixpath
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+from urllib.parse import quote
+
+from arcade_rag.database import Database, Document, DocumentInput, SearchMode
+from arcade_rag.databases.duckdb import INGEST_BATCH_SIZE, DuckDBDatabase
+from arcade_rag.object_storage import ObjectStorage
+
+# How many files the documents of a new collection are hash-partitioned into, by URI
+COLLECTION_SHARDS = int(os.getenv("RAG_COLLECTION_SHARDS", "1"))
+
+
+class ShardedDatabase(Database):
+    """
+    A database whose collections each live in their own files in object storage, so that a tool
+    call only transfers the files of the collection it uses, and writers to different collections
+    do not contend on one file.
+
+    The manifest, a small JSON object at `manifest_path`, lists the shard files of every
+    collection.  Each document is stored in one shard, chosen by a hash of its URI, so that all
+    of its chunks are together.  Shard files are opened within `exit_stack`, and written back to
+    object storage when it closes, unless it closes with an error.
+    """
+
+    def __init__(
+        self,
+        object_storage: ObjectStorage,
+        manifest_path: str,
+        exit_stack: ExitStack,
+        read_only: bool = False,
+        shards: int = COLLECTION_SHARDS,
+        build_shard: Callable[[str, bool], Database] = DuckDBDatabase,
+    ):
+        if shards < 1:
+            error_message = f"A collection needs at least one shard, not {shards}"
+            raise ValueError(error_message)
+
+        self.object_storage = object_storage
+        self.manifest_path = manifest_path
+        self.exit_stack = exit_stack
+        self.read_only = read_only
+        self.shards = shards
+        self.build_shard = build_shard
+        self.manifest: dict = {"collections": {}}
+        # The shards opened so far, by remote path, with whether they were opened for writing
+        self._open_shards: dict[str, tuple[Database, bool]] = {}
+
+    def connect(self) -> None:
+        with self.object_storage.with_downloaded_file(self.manifest_path) as local_path:
+            if os.path.exists(local_path):
+                self.manifest = self._read_manifest(local_path)
+
+    def disconnect(self) -> None:
+        # The shards are disconnected and uploaded as the exit stack closes
+        pass
+
+    def add_collection(self, collection_name: str) -> None:
+        prefix = posixpath.splitext(self.manifest_path)[0]
+        shard_paths = [
+            f"{prefix}/{quote(collection_name, safe='')}/{shard}-of-{self.shards}.duckdb"
+            for shard in range(self.shards)
+        ]
+        with self._update_manifest() as collections:
+            if collection_name in collections:
+                error_message = f"Collection {collection_name} already exists"
+                raise ValueError(error_message)
+            collections[collection_name] = {"shards": shard_paths}
+
+    def remove_collection(self, collection_name: str) -> None:
+        shard_paths = self._get_shard_paths(collection_name)
+        with self._update_manifest() as collections:
+            collections.pop(collection_name, None)
+        for shard_path in shard_paths:
+            # Writers which still have the shard open finish before it is deleted
+            with self.object_storage.with_lease(shard_path) as lease:
+                if self.object_storage.get_remote_metadata(shard_path) is not None:
+                    lease.check()
+                    self.object_storage.delete_remote_file(shard_path)
+
+    def list_collections(self) -> list[str]:
+        return list(self.manifest["collections"])
+
+    def check_collection_exists(self, collection_name: str) -> bool:
+        return collection_name in self.manifest["collections"]
+
+    def add_document(
+        self,
+        collection_name: str,
+        uri: str,
+        title: str,
+        document_body: str,
+        document_summary: str | None,
+        document_metadata: dict | None,
+    ) -> bool:
+        self.add_documents(
+            collection_name,
+            [
+                DocumentInput(
+                    uri=uri,
+                    title=title,
+                    body=document_body,
+                    summary=document_summary or "",
+                    metadata=document_metadata or {},
+                )
+            ],
+        )
+        return True
+
+    def add_documents(
+        self,
+        collection_name: str,
+        documents: Iterable[DocumentInput],
+        replace: bool = False,
+        batch_size: int = INGEST_BATCH_SIZE,
+    ) -> int:
+        """
+        Each shard writes its documents in its own transactions, so unlike a single database,
+        a failure can leave the documents of earlier batches or other shards written.
+        """
+        shard_paths = self._get_shard_paths(collection_name)
+
+        count = 0
+        replaced_uris: set[str] = set()
+        documents = iter(documents)
+        while batch := list(islice(documents, batch_size)):
+            batches_by_shard: dict[str, list[DocumentInput]] = {}
+            for document in batch:
+                shard_path = shard_paths[self._get_shard_index(document.uri, len(shard_paths))]
+                batches_by_shard.setdefault(shard_path, []).append(document)
+
+            for shard_path, shard_batch in batches_by_shard.items():
+                shard = self._open_shard_for_writing(collection_name, shard_path)
+                # Chunks of a document given in an earlier batch are not removed again
+                new_documents = [doc for doc in shard_batch if doc.uri not in replaced_uris]
+                seen_documents = [doc for doc in shard_batch if doc.uri in replaced_uris]
+                if new_documents:
+                    count += shard.add_documents(collection_name, new_documents, replace=replace)
+                if seen_documents:
+                    count += shard.add_documents(collection_name, seen_documents)
+            if replace:
+                replaced_uris |= {doc.uri for doc in batch}
+        return count
+
+    def remove_document(self, collection_name: str, uri: str) -> bool:
+        shard = self._open_shard_for_writing(
+            collection_name, self._get_document_shard_path(collection_name, uri)
+        )
+        return shard.remove_document(collection_name, uri)
+
+    def get_document(self, collection_name: str, uri: str) -> Document | None:
+        shard = self._open_shard_for_reading(
+            collection_name, self._get_document_shard_path(collection_name, uri)
+        )
+        return shard.get_document(collection_name, uri) if shard else None
+
+    def find_relevant_documents(
+        self,
+        collection_name: str,
+        query: str,
+        limit: int = 10,
+        min_score: float = 0.01,
+        search_mode: SearchMode = "vector",
+    ) -> list[Document]:
+        """
+        Every shard of the collection is searched, and the best of their results are returned.
+        Vector scores are the same whichever shard a document is in, but BM25 and rank fusion
+        scores are computed within each shard, so keyword and hybrid results are approximate.
+        """
+        documents = []
+        for shard_path in self._get_shard_paths(collection_name):
+            shard = self._open_shard_for_reading(collection_name, shard_path)
+            if shard is None:
+                continue
+            documents += shard.find_relevant_documents(
+                collection_name, query, limit, min_score, search_mode
+            )
+        documents.sort(key=lambda document: document.score or 0, reverse=True)
+        return documents[:limit]
+
+    def _open_shard_for_writing(self, collection_name: str, shard_path: str) -> Database:
+        """Open a shard of the collection to write, creating the collection in it if needed."""
+        if self.read_only:
+            error_message = f"Cannot write to {collection_name} in a read-only database"
+            raise ValueError(error_message)
+        shard = self._open_shard(shard_path, write=True)
+        if not shard.check_collection_exists(collection_name):
+            shard.add_collection(collection_name)
+        return shard
+
+    def _open_shard_for_reading(self, collection_name: str, shard_path: str) -> Database | None:
+        """Open a shard of the collection, or return None if nothing was written to it yet."""
+        shard = self._open_shard(shard_path, write=False)
+        return shard if shard.check_collection_exists(collection_name) else None
+
+    def _open_shard(self, shard_path: str, write: bool) -> Database:
+        """Download the shard, or reuse it if it is already open in this database."""
+        if shard_path in self._open_shards:
+            shard, writable = self._open_shards[shard_path]
+            if writable or not write:
+                return shard
+            error_message = f"Shard {shard_path} was opened to read before it was written to"
+            raise ValueError(error_message)
+
+        local_path = self.exit_stack.enter_context(
+            self.object_storage.with_locked_and_downloaded_file(shard_path)
+            if write
+            else self.object_storage.with_downloaded_file(shard_path)
+        )
+        shard = self.build_shard(local_path, not write)
+        shard.connect()
+        # Closed before the stack uploads the file
+        self.exit_stack.callback(shard.disconnect)
+        self._open_shards[shard_path] = (shard, write)
+        return shard
+
+    def _get_shard_paths(self, collection_name: str) -> list[str]:
+        collection = self.manifest["collections"].get(collection_name)
+        if collection is None:
+            error_message = f"Collection {collection_name} does not exist"
+            raise ValueError(error_message)
+        shard_paths: list[str] = collection["shards"]
+        return shard_paths
+
+    def _get_document_shard_path(self, collection_name: str, uri: str) -> str:
+        shard_paths = self._get_shard_paths(collection_name)
+        return shard_paths[self._get_shard_index(uri, len(shard_paths))]
+
+    def _get_shard_index(self, uri: str, shards: int) -> int:
+        # Python's hash() differs between processes, so a stable hash is used
+        return int.from_bytes(hashlib.sha256(uri.encode()).digest()[:8], "big") % shards
+
+    @contextmanager
+    def _update_manifest(self) -> Iterator[dict]:
+        """
+        Lock the manifest, and yield its latest collections to change.
+        The manifest is uploaded when done, unless it has changed remotely in the meantime.
+        """
+        if self.read_only:
+            error_message = "Cannot change the collections of a read-only database"
+            raise ValueError(error_message)
+
+        with self.object_storage.with_locked_and_downloaded_file(self.manifest_path) as local_path:
+            manifest = (
+                self._read_manifest(local_path)
+                if os.path.exists(local_path)
+                else {"collections": {}}
+            )
+            yield manifest["collections"]
+            with open(local_path, "w") as f:
+                json.dump(manifest, f)
+        self.manifest = manifest
+
+    def _read_manifest(self, local_path: str) -> dict:
+        with open(local_path) as f:
+            manifest: dict = json.load(f)
+        return manifest
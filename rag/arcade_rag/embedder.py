@@ -1,11 +1,200 @@
+import hashlib
+import json
 import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any
 
-from sentence_transformers import SentenceTransformer
+import numpy as np
+
+from arcade_rag.embedding_backend import EmbeddingBackend, build_embedding_backend
 
 MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
-model = SentenceTransformer(MODEL_NAME)
-MODEL_VEC_SIZE = model.get_sentence_embedding_dimension()
+# How the model is run: torch, onnx, or onnx-int8
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+# Load the model in the background as soon as the tools are imported
+EMBEDDING_PREWARM = os.getenv("EMBEDDING_PREWARM", "false").lower() in ("1", "true")
+
+_backend: EmbeddingBackend | None = None
+_backend_lock = threading.Lock()
+_model_vec_size: int | None = None
+
+
+def get_backend() -> EmbeddingBackend:
+    """
+    Load the embedding model on first use, and share it across the process.
+    Importing the backend's runtime (e.g. torch) is slow, so it is also deferred until now.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = build_embedding_backend(EMBEDDING_BACKEND, MODEL_NAME)
+    return _backend
+
+
+def prewarm_model() -> threading.Thread:
+    """Load the embedding model in a background thread."""
+    thread = threading.Thread(target=get_backend, name="embedding-model-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_model_vec_size() -> int:
+    """
+    The dimension of the model's embeddings.
+    This is read from the model's configuration files when possible, so that the model itself
+    does not need to be loaded.
+    """
+    global _model_vec_size
+    if _model_vec_size is None:
+        if os.getenv("EMBEDDING_MODEL_DIMENSION"):
+            _model_vec_size = int(os.environ["EMBEDDING_MODEL_DIMENSION"])
+        elif _backend is None and (dimension := _read_model_vec_size()) is not None:
+            _model_vec_size = dimension
+        else:
+            _model_vec_size = get_backend().dimension
+    return _model_vec_size
+
+
+def _read_model_vec_size() -> int | None:
+    modules = _read_model_config("modules.json")
+    if not modules or any("Dense" in module.get("type", "") for module in modules):
+        # A dense layer changes the dimension of the pooled embedding
+        return None
+    pooling_path = next(
+        (module["path"] for module in modules if module.get("type", "").endswith("Pooling")), None
+    )
+    if pooling_path is None:
+        return None
+    pooling = _read_model_config(f"{pooling_path}/config.json") or {}
+    # Newer versions of sentence-transformers renamed this key
+    return pooling.get("word_embedding_dimension") or pooling.get("embedding_dimension")
+
+
+def _read_model_config(filename: str) -> Any:
+    try:
+        if os.path.isdir(MODEL_NAME):
+            path = os.path.join(MODEL_NAME, filename)
+        else:
+            from huggingface_hub import hf_hub_download
+
+            repo_id = MODEL_NAME if "/" in MODEL_NAME else f"sentence-transformers/{MODEL_NAME}"
+            path = hf_hub_download(repo_id, filename)
+        with open(path) as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+class EmbeddingStore(ABC):
+    """A persistent tier for the embedding cache, e.g. a table in the database."""
+
+    @abstractmethod
+    def get_embeddings(self, keys: list[str]) -> dict[str, np.ndarray]:
+        pass
+
+    @abstractmethod
+    def put_embeddings(self, embeddings: dict[str, np.ndarray]) -> None:
+        pass
+
+
+class EmbeddingCache:
+    """A thread-safe, in-memory LRU cache of embeddings."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+            return embedding
+
+    def put(self, key: str, embedding: np.ndarray) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_SIZE)
+
+
+def get_embedding_cache_key(text: str) -> str:
+    # Backends give slightly different embeddings, so they do not share cache entries
+    return f"{MODEL_NAME}:{EMBEDDING_BACKEND}:{hashlib.sha256(text.encode()).hexdigest()}"
 
 
 def embed_text(text: str) -> list[float]:
-    return model.encode(text).tolist()
+    return embed_texts([text])[0].tolist()
+
+
+def embed_texts(
+    texts: list[str],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    store: EmbeddingStore | None = None,
+) -> np.ndarray:
+    """
+    Embed many texts in batches of `batch_size`.
+    Returns a contiguous float32 matrix of shape (len(texts), get_model_vec_size()).
+
+    Embeddings are cached by model name and text hash, in memory and then in the optional
+    `store`, so text which has been seen before is not run through the model again.
+    """
+    embeddings = np.empty((len(texts), get_model_vec_size()), dtype=np.float32)
+
+    # The rows of the result which still need an embedding, grouped by cache key
+    missing: dict[str, list[int]] = {}
+    # Embeddings the store may not have yet, as it is only consulted on in-memory misses
+    to_store: dict[str, np.ndarray] = {}
+    for i, text in enumerate(texts):
+        key = get_embedding_cache_key(text)
+        cached = embedding_cache.get(key)
+        if cached is None:
+            missing.setdefault(key, []).append(i)
+        else:
+            embeddings[i] = cached
+            to_store[key] = cached
+
+    if missing and store is not None:
+        for key, embedding in store.get_embeddings(list(missing)).items():
+            embeddings[missing.pop(key)] = embedding
+            embedding_cache.put(key, np.asarray(embedding, dtype=np.float32))
+
+    if missing:
+        keys = list(missing)
+        encoded = get_backend().encode(
+            [texts[missing[key][0]] for key in keys], batch_size=batch_size
+        )
+        for key, embedding in zip(keys, encoded, strict=True):
+            embeddings[missing[key]] = embedding
+            embedding_cache.put(key, embedding.copy())
+            to_store[key] = embedding
+
+    if store is not None:
+        store.put_embeddings(to_store)
+
+    return embeddings
+
+
+def __getattr__(name: str) -> Any:
+    # Kept for backwards compatibility; these used to be loaded at import time
+    if name == "MODEL_VEC_SIZE":
+        return get_model_vec_size()
+    if name == "model":
+        return get_backend().model  # type: ignore[attr-defined]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")  # noqa: TRY003
@@ -0,0 +1,97 @@
+from abc import ABC, abstractmethod
+from typing import Any
+
+import numpy as np
+
+
+class EmbeddingBackend(ABC):
+    """A way of running an embedding model, e.g. with PyTorch or ONNX Runtime."""
+
+    name: str
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    @property
+    @abstractmethod
+    def dimension(self) -> int:
+        pass
+
+    @property
+    @abstractmethod
+    def max_tokens(self) -> int:
+        """The most tokens of a text the model reads; the rest of the text is ignored."""
+        pass
+
+    @abstractmethod
+    def encode(self, texts: list[str], batch_size: int) -> np.ndarray:
+        """Returns a float32 matrix of shape (len(texts), dimension)."""
+        pass
+
+    @abstractmethod
+    def get_token_offsets(self, text: str) -> list[tuple[int, int]]:
+        """The (start, end) character offsets of each of the model's tokens in the text."""
+        pass
+
+
+class SentenceTransformerEmbeddingBackend(EmbeddingBackend):
+    """A backend which loads the model through sentence-transformers into `self.model`."""
+
+    model: Any
+
+    @property
+    def dimension(self) -> int:
+        return int(self.model.get_sentence_embedding_dimension())
+
+    @property
+    def max_tokens(self) -> int:
+        # The sequence includes the tokenizer's special tokens, e.g. [CLS] and [SEP]
+        special_tokens = int(self.model.tokenizer.num_special_tokens_to_add())
+        return int(self.model.max_seq_length) - special_tokens
+
+    def encode(self, texts: list[str], batch_size: int) -> np.ndarray:
+        embeddings = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def get_token_offsets(self, text: str) -> list[tuple[int, int]]:
+        encoding = self.model.tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+        )
+        return [(int(start), int(end)) for start, end in encoding["offset_mapping"]]
+
+
+def build_embedding_backend(backend_name: str, model_name: str) -> EmbeddingBackend:
+    # Backends are imported on demand, as each pulls in a heavy runtime
+    if backend_name == "torch":
+        from arcade_rag.embedding_backends.torch import TorchEmbeddingBackend
+
+        return TorchEmbeddingBackend(model_name)
+    if backend_name == "onnx":
+        from arcade_rag.embedding_backends.onnx import ONNXEmbeddingBackend
+
+        return ONNXEmbeddingBackend(model_name)
+    if backend_name == "onnx-int8":
+        from arcade_rag.embedding_backends.onnx import ONNXInt8EmbeddingBackend
+
+        return ONNXInt8EmbeddingBackend(model_name)
+
+    error_message = f"Unknown embedding backend {backend_name}"
+    raise ValueError(error_message)
+
+
+def check_backend_parity(
+    backend: EmbeddingBackend, reference: EmbeddingBackend, texts: list[str]
+) -> float:
+    """
+    Compare the embeddings of two backends for the same texts.
+    Returns the lowest cosine similarity between the two backends' embeddings of a text.
+    """
+    if backend.dimension != reference.dimension:
+        return 0.0
+
+    embeddings = backend.encode(texts, batch_size=len(texts))
+    reference_embeddings = reference.encode(texts, batch_size=len(texts))
+    similarities = np.sum(embeddings * reference_embeddings, axis=1) / (
+        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference_embeddings, axis=1)
+    )
+    return float(similarities.min())
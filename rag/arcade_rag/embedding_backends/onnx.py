@@ -0,0 +1,59 @@
+import glob
+import os
+import tempfile
+
+from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+from arcade_rag.embedding_backend import SentenceTransformerEmbeddingBackend
+
+# Where models which have to be converted locally are stored
+EMBEDDING_EXPORT_DIR = os.getenv(
+    "EMBEDDING_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "arcade_rag", "models")
+)
+# The instruction set the int8 model is quantized for: avx2, avx512, avx512_vnni, or arm64
+EMBEDDING_QUANTIZATION_CONFIG = os.getenv("EMBEDDING_QUANTIZATION_CONFIG", "avx2")
+
+
+class ONNXEmbeddingBackend(SentenceTransformerEmbeddingBackend):
+    """
+    Runs the model with ONNX Runtime on the CPU.
+    Models which do not ship an ONNX export are converted when they are loaded.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        self.model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+
+
+class ONNXInt8EmbeddingBackend(SentenceTransformerEmbeddingBackend):
+    """
+    Runs an int8 dynamically-quantized version of the model with ONNX Runtime on the CPU.
+    The quantized model is exported once, and reused from EMBEDDING_EXPORT_DIR afterwards.
+    """
+
+    name = "onnx-int8"
+
+    def __init__(self, model_name: str, quantization_config: str = EMBEDDING_QUANTIZATION_CONFIG):
+        super().__init__(model_name)
+        self.quantization_config = quantization_config
+
+        export_dir = os.path.join(EMBEDDING_EXPORT_DIR, model_name.strip("/").replace("/", "--"))
+        file_name = self._find_quantized_file(export_dir)
+        if file_name is None:
+            model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+            model.save(export_dir)
+            export_dynamic_quantized_onnx_model(model, quantization_config, export_dir)
+            file_name = self._find_quantized_file(export_dir)
+
+        self.model = SentenceTransformer(
+            export_dir, backend="onnx", device="cpu", model_kwargs={"file_name": file_name}
+        )
+
+    def _find_quantized_file(self, export_dir: str) -> str | None:
+        # e.g. onnx/model_qint8_avx512_vnni.onnx or onnx/model_quint8_avx2.onnx
+        paths = glob.glob(
+            os.path.join(export_dir, "onnx", f"model_*int8_{self.quantization_config}.onnx")
+        )
+        return os.path.relpath(paths[0], export_dir) if paths else None
@@ -0,0 +1,11 @@
+from sentence_transformers import SentenceTransformer
+
+from arcade_rag.embedding_backend import SentenceTransformerEmbeddingBackend
+
+
+class TorchEmbeddingBackend(SentenceTransformerEmbeddingBackend):
+    name = "torch"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        self.model = SentenceTransformer(model_name)
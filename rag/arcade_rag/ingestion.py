@@ -0,0 +1,40 @@
+import os
+from collections.abc import Iterator
+
+from arcade_rag.chunker import chunk_text
+from arcade_rag.database import DocumentInput
+
+
+def iter_document_chunks(
+    file_url_or_path: str,
+    title: str | None = None,
+    metadata: dict | None = None,
+    summary: str = "",
+) -> Iterator[DocumentInput]:
+    """
+    Parse a document with arcade_parse, and yield its text as chunks to be stored under the
+    document's URI, with sequential chunk IDs.
+    Pages are parsed and chunked as they are needed, so that the whole document is never in memory.
+    The page each chunk comes from is added to its metadata.
+    """
+    try:
+        from arcade_parse.tools.parse import iter_document_pages
+    except ImportError as e:
+        error_message = "Parsing documents requires arcade_parse.  Install the 'parse' extra."
+        raise ImportError(error_message) from e
+
+    if title is None:
+        title = os.path.basename(file_url_or_path.rstrip("/")) or file_url_or_path
+
+    chunk_id = 0
+    for page_number, page in enumerate(iter_document_pages(file_url_or_path), start=1):
+        for chunk in chunk_text(page):
+            yield DocumentInput(
+                uri=file_url_or_path,
+                title=title,
+                body=chunk,
+                summary=summary,
+                metadata={**(metadata or {}), "page": page_number},
+                chunk_id=chunk_id,
+            )
+            chunk_id += 1
@@ -1,10 +1,59 @@
+import atexit
 import hashlib
+import json
+import os
+import random
+import shutil
 import tempfile
+import threading
+import time
+import uuid
 from abc import ABC, abstractmethod
-from contextlib import contextmanager
+from collections.abc import Iterator
+from contextlib import contextmanager, suppress
+from typing import ClassVar
+
+from pydantic import BaseModel
+
+REPLICA_DIR = os.getenv("RAG_REPLICA_DIR", os.path.join(tempfile.gettempdir(), "arcade_rag"))
+
+# Writers hold a lease on a lock object next to the file, so that writers in other processes wait
+# for them rather than overwrite their changes.  The lease expires unless it is renewed, so that
+# the lock is not held forever by a writer which has died.
+LOCK_SUFFIX = ".lock"
+LOCK_TTL_SECONDS = float(os.getenv("RAG_LOCK_TTL_SECONDS", "30"))
+# How long a writer waits for the lock, behind writers in this process or others, before giving up
+LOCK_WAIT_SECONDS = float(os.getenv("RAG_LOCK_WAIT_SECONDS", "60"))
+# How long a writer first waits before trying to take the lock again; this doubles on each try
+LOCK_RETRY_SECONDS = 0.1
+LOCK_MAX_RETRY_SECONDS = 2.0
+
+
+class RemoteFileMetadata(BaseModel):
+    """Cheap-to-fetch identity of a remote file, used to tell if a local replica is stale."""
+
+    size: int
+    etag: str | None = None
+    version_id: str | None = None
+
+
+class LocalReplica(BaseModel):
+    local_path: str
+    metadata: RemoteFileMetadata | None
+    """The metadata of the remote file when it was downloaded, or None if it did not exist."""
 
 
 class ObjectStorage(ABC):
+    # Local replicas are shared by every ObjectStorage instance in the process,
+    # so that each tool call only has to revalidate the file, not download it.
+    _replicas: ClassVar[dict[str, LocalReplica]] = {}
+    _locks: ClassVar[dict[str, threading.Lock]] = {}
+    _locks_guard: ClassVar[threading.Lock] = threading.Lock()
+    # How many readers have each replica file open, so that a replica which has been superseded
+    # by a newer version is only removed once its last reader is done
+    _replica_readers: ClassVar[dict[str, int]] = {}
+    _superseded_replicas: ClassVar[set[str]] = set()
+
     @abstractmethod
     def upload_file(self, local_path: str, remote_path: str) -> bool:
         pass
@@ -17,6 +66,37 @@ class ObjectStorage(ABC):
     def delete_remote_file(self, remote_path: str) -> bool:
         pass
 
+    @abstractmethod
+    def get_remote_metadata(self, remote_path: str) -> RemoteFileMetadata | None:
+        """Return the metadata of the remote file without downloading it, or None if missing."""
+        pass
+
+    @abstractmethod
+    def read_remote_file(self, remote_path: str) -> tuple[bytes, RemoteFileMetadata] | None:
+        """Return the content and metadata of a small remote file, or None if it is missing."""
+        pass
+
+    @abstractmethod
+    def write_remote_file_if(
+        self, remote_path: str, content: bytes, etag: str | None
+    ) -> RemoteFileMetadata | None:
+        """
+        Write a small remote file, but only if its ETag is `etag`, or if it does not exist when
+        `etag` is None.  The check and the write are atomic.
+        Returns the metadata of the new file, or None if the condition did not hold.
+        """
+        pass
+
+    @abstractmethod
+    def delete_remote_file_if(self, remote_path: str, etag: str) -> bool:
+        """Delete the remote file if its ETag is `etag`.  Returns whether it was deleted."""
+        pass
+
+    @property
+    def storage_id(self) -> str:
+        """Identifies the remote namespace (e.g. the bucket) that remote paths are relative to."""
+        return self.__class__.__name__
+
     def get_remote_hash(self, remote_path: str) -> str:
         with tempfile.NamedTemporaryFile(delete=True) as tmp:
             self.download_file(remote_path, tmp.name)
@@ -29,22 +109,288 @@ class ObjectStorage(ABC):
             _hash = hashlib.md5(f.read()).hexdigest()  # noqa: S324
         return _hash
 
+    def get_local_replica(self, remote_path: str) -> LocalReplica:
+        """
+        Return an up-to-date local copy of the remote file.
+        The remote file is only downloaded again if its metadata has changed since the last sync.
+        The copy is removed once a newer version replaces it; use with_downloaded_file to keep
+        it while it is read.
+        """
+        with self._get_lock(remote_path, "sync"):
+            return self._refresh_local_replica(remote_path)
+
+    @contextmanager
+    def with_downloaded_file(self, remote_path: str) -> Iterator[str]:
+        """
+        Yield the path of the local replica of the remote file, for reading only.
+        Nothing is locked, re-hashed, or uploaded.
+        """
+        with self._read_local_replica(remote_path) as replica:
+            yield replica.local_path
+
+    @contextmanager
+    def with_lease(
+        self,
+        remote_path: str,
+        ttl_seconds: float = LOCK_TTL_SECONDS,
+        wait_seconds: float = LOCK_WAIT_SECONDS,
+    ) -> Iterator["Lease"]:
+        """
+        Hold the lock on the remote file, shared by every process using the storage.
+        Writers in this process queue for it first, so that only one of them polls the storage.
+        Raises TimeoutError if the lock is not free within `wait_seconds`.
+        """
+        deadline = time.monotonic() + wait_seconds
+        local_lock = self._get_lock(remote_path, "write")
+        if not local_lock.acquire(timeout=wait_seconds):
+            error_message = f"Timed out waiting for other writers of {remote_path} to finish"
+            raise TimeoutError(error_message)
+        try:
+            lease = Lease(self, f"{remote_path}{LOCK_SUFFIX}", ttl_seconds)
+            lease.acquire(deadline)
+            try:
+                yield lease
+            finally:
+                lease.release()
+        finally:
+            local_lock.release()
+
     @contextmanager
     def with_locked_and_downloaded_file(
         self,
         remote_path: str,
-    ):
-        with tempfile.NamedTemporaryFile(delete=True) as tmp:
-            downloaded = self.download_file(remote_path, tmp.name)
+    ) -> Iterator[str]:
+        """
+        Yield the path of a local working copy of the remote file, and upload it when done.
+        The working copy is a copy of the local replica, so readers of the replica never see
+        partial writes.
+        The remote file is locked throughout, so writers wait for each other's changes rather
+        than overwrite them.
+        """
+        with (
+            self.with_lease(remote_path) as lease,
+            self._read_local_replica(remote_path) as replica,
+        ):
+            os.makedirs(REPLICA_DIR, exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=REPLICA_DIR) as tmp_dir:
+                working_path = os.path.join(tmp_dir, os.path.basename(remote_path))
+                if replica.metadata is not None:
+                    shutil.copyfile(replica.local_path, working_path)
+
+                yield working_path
+
+                lease.check()
+                if self.get_remote_metadata(remote_path) != replica.metadata:
+                    error_message = f"File {remote_path} has changed on remote storage between the time it was downloaded and the time it was uploaded"  # noqa: E501
+                    raise ValueError(error_message)
+
+                self.upload_file(working_path, remote_path)
+                metadata = self.get_remote_metadata(remote_path)
+
+                local_path = self._create_replica_path(remote_path)
+                os.replace(working_path, local_path)
+                with self._get_lock(remote_path, "sync"):
+                    self._set_local_replica(
+                        remote_path, LocalReplica(local_path=local_path, metadata=metadata)
+                    )
+
+    @contextmanager
+    def _read_local_replica(self, remote_path: str) -> Iterator[LocalReplica]:
+        """Yield an up-to-date local replica, which is not removed until the caller is done."""
+        with self._get_lock(remote_path, "sync"):
+            replica = self._refresh_local_replica(remote_path)
+            with self._locks_guard:
+                self._replica_readers[replica.local_path] = (
+                    self._replica_readers.get(replica.local_path, 0) + 1
+                )
+        try:
+            yield replica
+        finally:
+            with self._locks_guard:
+                self._replica_readers[replica.local_path] -= 1
+                remove = False
+                if not self._replica_readers[replica.local_path]:
+                    del self._replica_readers[replica.local_path]
+                    remove = replica.local_path in self._superseded_replicas
+                    self._superseded_replicas.discard(replica.local_path)
+            if remove:
+                _remove_replica_file(replica.local_path)
+
+    def _refresh_local_replica(self, remote_path: str) -> LocalReplica:
+        key = self._get_replica_key(remote_path)
+        metadata = self.get_remote_metadata(remote_path)
+        replica = self._replicas.get(key)
+        if (
+            replica is not None
+            and replica.metadata == metadata
+            and (metadata is None or os.path.exists(replica.local_path))
+        ):
+            return replica
+
+        # Where there is no replica; nothing is ever written there
+        local_path = os.path.join(
+            REPLICA_DIR,
+            f"{self._get_replica_prefix(remote_path)}-{os.path.basename(remote_path)}",
+        )
+        if metadata is not None:
+            download_path = self._create_replica_path(remote_path)
+            try:
+                downloaded = self.download_file(remote_path, download_path)
+            except BaseException:
+                _remove_replica_file(download_path)
+                raise
             if downloaded:
-                local_hash = self.get_local_hash(tmp.name)
+                local_path = download_path
+            else:
+                _remove_replica_file(download_path)
+                metadata = None
 
-            with open(tmp.name, "rb") as f:
-                yield f
+        replica = LocalReplica(local_path=local_path, metadata=metadata)
+        self._set_local_replica(remote_path, replica)
+        return replica
+
+    def _set_local_replica(self, remote_path: str, replica: LocalReplica) -> None:
+        """Make `replica` the current one, removing the previous one once nobody reads it."""
+        previous = self._replicas.get(self._get_replica_key(remote_path))
+        self._replicas[self._get_replica_key(remote_path)] = replica
+        if previous is None or previous.local_path == replica.local_path:
+            return
+        with self._locks_guard:
+            if previous.local_path in self._replica_readers:
+                self._superseded_replicas.add(previous.local_path)
+                return
+        _remove_replica_file(previous.local_path)
+
+    def _create_replica_path(self, remote_path: str) -> str:
+        """
+        Create an empty file for a new version of the replica.
+        Every version gets a file of its own, which is never replaced, even by other processes
+        sharing REPLICA_DIR: readers keep the version they opened, and a database which caches
+        open files by path (as DuckDB does) cannot serve an older version from that cache.
+        """
+        os.makedirs(REPLICA_DIR, exist_ok=True)
+        fd, local_path = tempfile.mkstemp(
+            dir=REPLICA_DIR,
+            prefix=f"{self._get_replica_prefix(remote_path)}-",
+            suffix=f"-{os.path.basename(remote_path)}",
+        )
+        os.close(fd)
+        return local_path
+
+    def _get_replica_prefix(self, remote_path: str) -> str:
+        return hashlib.sha256(self._get_replica_key(remote_path).encode()).hexdigest()[:16]
+
+    def _get_replica_key(self, remote_path: str) -> str:
+        return f"{self.storage_id}/{remote_path}"
+
+    def _get_lock(self, remote_path: str, purpose: str) -> threading.Lock:
+        lock_key = f"{purpose}:{self._get_replica_key(remote_path)}"
+        with self._locks_guard:
+            return self._locks.setdefault(lock_key, threading.Lock())
+
+
+class Lease:
+    """
+    A lease on a lock object, which only one owner can hold at a time.
+    The lock object records its owner and when the lease expires.  A background thread renews
+    the lease while it is held; a lease which has not been renewed by the time it expires can be
+    taken over by another writer.
+    """
+
+    def __init__(self, storage: ObjectStorage, lock_path: str, ttl_seconds: float):
+        self.storage = storage
+        self.lock_path = lock_path
+        self.ttl_seconds = ttl_seconds
+        self.owner = uuid.uuid4().hex
+        self.etag: str | None = None
+        self.lost = False
+        self._released = threading.Event()
+        self._heartbeat: threading.Thread | None = None
+
+    def acquire(self, deadline: float) -> None:
+        delay = LOCK_RETRY_SECONDS
+        while not self._try_acquire():
+            if time.monotonic() + delay > deadline:
+                error_message = f"Timed out waiting for the lock {self.lock_path}"
+                raise TimeoutError(error_message)
+            # Jitter, so that waiting writers do not all try again at once
+            time.sleep(delay * random.uniform(0.5, 1))  # noqa: S311
+            delay = min(delay * 2, LOCK_MAX_RETRY_SECONDS)
+
+        self._heartbeat = threading.Thread(
+            target=self._renew, name=f"lease-heartbeat-{self.lock_path}", daemon=True
+        )
+        self._heartbeat.start()
+
+    def check(self) -> None:
+        """Raise if the lease expired, or was taken over, while it was held."""
+        if self.lost:
+            error_message = f"The lock {self.lock_path} was lost before the write finished"
+            raise ValueError(error_message)
+
+    def release(self) -> None:
+        self._released.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        if self.etag is not None and not self.lost:
+            self.storage.delete_remote_file_if(self.lock_path, self.etag)
+
+    def _try_acquire(self) -> bool:
+        metadata = self.storage.write_remote_file_if(self.lock_path, self._get_content(), None)
+        if metadata is None:
+            current = self.storage.read_remote_file(self.lock_path)
+            if current is not None and _is_expired(current[0]):
+                # Take over from a writer which stopped renewing its lease
+                metadata = self.storage.write_remote_file_if(
+                    self.lock_path, self._get_content(), current[1].etag
+                )
+        if metadata is None:
+            return False
+        self.etag = metadata.etag
+        return True
+
+    def _renew(self) -> None:
+        renewed_at = time.monotonic()
+        while not self._released.wait(self.ttl_seconds / 3):
+            try:
+                metadata = self.storage.write_remote_file_if(
+                    self.lock_path, self._get_content(), self.etag
+                )
+            except Exception:
+                # Try again on the next beat, while the lease is still valid
+                metadata = None
+                if time.monotonic() - renewed_at < self.ttl_seconds:
+                    continue
+            if metadata is None:
+                self.lost = True
+                return
+            self.etag = metadata.etag
+            renewed_at = time.monotonic()
+
+    def _get_content(self) -> bytes:
+        return json.dumps({
+            "owner": self.owner,
+            "expires_at": time.time() + self.ttl_seconds,
+        }).encode()
+
+
+def _remove_replica_file(local_path: str) -> None:
+    with suppress(FileNotFoundError):
+        os.remove(local_path)
+
+
+@atexit.register
+def _remove_replica_files() -> None:
+    """Remove this process's replicas when it exits, as no other process will use them."""
+    for replica in ObjectStorage._replicas.values():
+        _remove_replica_file(replica.local_path)
+    for local_path in ObjectStorage._superseded_replicas:
+        _remove_replica_file(local_path)
 
-            remote_hash = self.get_remote_hash(remote_path)
-            if downloaded and local_hash != remote_hash:
-                error_message = f"File {remote_path} has changed on remote storage between the time it was downloaded and the time it was uploaded"  # noqa: E501
-                raise ValueError(error_message)
 
-            self.upload_file(tmp.name, remote_path)
+def _is_expired(content: bytes) -> bool:
+    try:
+        return bool(json.loads(content)["expires_at"] < time.time())
+    except (ValueError, KeyError, TypeError):
+        # Not a lease, so nobody can renew it
+        return True
@@ -2,7 +2,10 @@ import boto3
 import botocore
 import botocore.exceptions
 
-from arcade_rag.object_storage import ObjectStorage
+from arcade_rag.object_storage import ObjectStorage, RemoteFileMetadata
+
+# How S3 answers a conditional request whose condition does not hold, or which raced another
+CONDITION_FAILED_CODES = ("PreconditionFailed", "ConditionalRequestConflict", "412", "409")
 
 
 class S3ObjectStorage(ObjectStorage):
@@ -21,6 +24,10 @@ class S3ObjectStorage(ObjectStorage):
         )
         self.bucket_name = bucket_name
 
+    @property
+    def storage_id(self) -> str:
+        return f"s3://{self.bucket_name}"
+
     def upload_file(self, local_path: str, remote_path: str) -> bool:
         self.client.upload_file(
             Filename=local_path,
@@ -45,3 +52,62 @@ class S3ObjectStorage(ObjectStorage):
     def delete_remote_file(self, remote_path: str) -> bool:
         self.client.delete_object(Bucket=self.bucket_name, Key=remote_path)
         return True
+
+    def read_remote_file(self, remote_path: str) -> tuple[bytes, RemoteFileMetadata] | None:
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=remote_path)
+        except botocore.exceptions.ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise error  # noqa: TRY201
+        return response["Body"].read(), RemoteFileMetadata(
+            size=response["ContentLength"],
+            etag=response.get("ETag", "").strip('"') or None,
+            version_id=response.get("VersionId"),
+        )
+
+    def write_remote_file_if(
+        self, remote_path: str, content: bytes, etag: str | None
+    ) -> RemoteFileMetadata | None:
+        # S3 conditional writes: If-None-Match creates the object only if it does not exist,
+        # and If-Match replaces it only if it is unchanged
+        condition = {"IfNoneMatch": "*"} if etag is None else {"IfMatch": f'"{etag}"'}
+        try:
+            response = self.client.put_object(
+                Bucket=self.bucket_name, Key=remote_path, Body=content, **condition
+            )
+        except botocore.exceptions.ClientError as error:
+            if error.response.get("Error", {}).get("Code") in CONDITION_FAILED_CODES:
+                return None
+            raise error  # noqa: TRY201
+        return RemoteFileMetadata(
+            size=len(content),
+            etag=response.get("ETag", "").strip('"') or None,
+            version_id=response.get("VersionId"),
+        )
+
+    def delete_remote_file_if(self, remote_path: str, etag: str) -> bool:
+        try:
+            self.client.delete_object(Bucket=self.bucket_name, Key=remote_path, IfMatch=f'"{etag}"')
+        except botocore.exceptions.ClientError as error:
+            if error.response.get("Error", {}).get("Code") in (
+                *CONDITION_FAILED_CODES,
+                "404",
+                "NoSuchKey",
+            ):
+                return False
+            raise error  # noqa: TRY201
+        return True
+
+    def get_remote_metadata(self, remote_path: str) -> RemoteFileMetadata | None:
+        try:
+            response = self.client.head_object(Bucket=self.bucket_name, Key=remote_path)
+        except botocore.exceptions.ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise error  # noqa: TRY201
+        return RemoteFileMetadata(
+            size=response["ContentLength"],
+            etag=response.get("ETag", "").strip('"') or None,
+            version_id=response.get("VersionId"),
+        )
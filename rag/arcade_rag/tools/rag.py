@@ -1,9 +1,15 @@
+import os
+from collections.abc import Iterator
+from contextlib import ExitStack, contextmanager
 from typing import Annotated
 
 from arcade.sdk import ToolContext, tool
 
-from arcade_rag.database import Document
+from arcade_rag.database import Database, Document, DocumentInput, SearchMode
 from arcade_rag.databases.duckdb import DuckDBDatabase
+from arcade_rag.databases.sharded import ShardedDatabase
+from arcade_rag.embedder import EMBEDDING_PREWARM, prewarm_model
+from arcade_rag.ingestion import iter_document_chunks
 from arcade_rag.object_storages.s3 import S3ObjectStorage
 
 REQUIRED_SECRETS = [
@@ -14,6 +20,13 @@ REQUIRED_SECRETS = [
     "RAG_DATABASE_FILE",
 ]
 
+# Store each collection in its own files, listed in a manifest at RAG_DATABASE_FILE, rather than
+# every collection in the one database file
+SHARDED_DATABASE = os.getenv("RAG_SHARDED_DATABASE", "false").lower() in ("1", "true")
+
+if EMBEDDING_PREWARM:
+    prewarm_model()
+
 
 @tool(requires_secrets=REQUIRED_SECRETS)
 def add_rag_collection(
@@ -21,9 +34,7 @@ def add_rag_collection(
     collection_name: Annotated[str, "The name of the RAG collection to add"],
 ) -> bool:
     """Add a collection to the RAG database to store documents."""
-    object_storage = build_object_storage_client(context)
-    database = build_database_client(context)
-    with object_storage.with_locked_and_downloaded_file(database.db_path) as f:
+    with with_database(context) as database:
         database.add_collection(collection_name)
 
     return True
@@ -35,9 +46,7 @@ def remove_rag_collection(
     collection_name: Annotated[str, "The name of the RAG collection to add"],
 ) -> bool:
     """Remove a previously added collection from the RAG database."""
-    object_storage = build_object_storage_client(context)
-    database = build_database_client(context)
-    with object_storage.with_locked_and_downloaded_file(database.db_path) as f:
+    with with_database(context) as database:
         database.remove_collection(collection_name)
 
     return True
@@ -48,9 +57,7 @@ def list_rag_collections(
     context: ToolContext,
 ) -> list[str]:
     """List all collections in the RAG database."""
-    object_storage = build_object_storage_client(context)
-    database = build_database_client(context)
-    with object_storage.with_locked_and_downloaded_file(database.db_path) as f:
+    with with_database(context, read_only=True) as database:
         return database.list_collections()
 
 
@@ -71,14 +78,50 @@ def add_rag_document(
     ],
 ) -> bool:
     """Add a document to the RAG database for later retrieval."""
-    object_storage = build_object_storage_client(context)
-    database = build_database_client(context)
-    with object_storage.with_locked_and_downloaded_file(database.db_path) as f:
+    with with_database(context) as database:
         database.add_document(collection_name, uri, title, body, summary, metadata)
 
     return True
 
 
+@tool(requires_secrets=REQUIRED_SECRETS)
+def add_rag_documents(
+    context: ToolContext,
+    collection_name: Annotated[str, "The name of the RAG collection to add the documents to"],
+    documents: Annotated[
+        list[dict],
+        "The documents to add.  Each document is a JSON dictionary with the keys 'uri', 'title', 'body', 'summary', and 'metadata' (a JSON dictionary).",  # noqa: E501
+    ],
+) -> int:
+    """Add many documents to the RAG database at once.  Returns the number of documents added."""
+    document_inputs = [DocumentInput.model_validate(document) for document in documents]
+    with with_database(context) as database:
+        return database.add_documents(collection_name, document_inputs)
+
+
+@tool(requires_secrets=REQUIRED_SECRETS)
+def ingest_rag_document(
+    context: ToolContext,
+    collection_name: Annotated[str, "The name of the RAG collection to add the document to"],
+    file_url_or_path: Annotated[str, "The url or path of the file to parse and add"],
+    title: Annotated[
+        str | None, "The title of the document.  If not provided, the file name is used"
+    ] = None,
+    metadata: Annotated[
+        dict | None, "Metadata to store with every chunk of the document, as a JSON dictionary"
+    ] = None,
+) -> int:
+    """
+    Parse a file (e.g. a PDF, Word document, spreadsheet or web page) and add its text to the RAG
+    database, split into chunks.  The document's text is never returned.
+    Prefer this tool to parsing a document and passing its text to <AddRagDocument>.
+    Returns the number of chunks added.
+    """
+    chunks = iter_document_chunks(file_url_or_path, title, metadata)
+    with with_database(context) as database:
+        return database.add_documents(collection_name, chunks, replace=True)
+
+
 @tool(requires_secrets=REQUIRED_SECRETS)
 def remove_rag_document(
     context: ToolContext,
@@ -86,9 +129,7 @@ def remove_rag_document(
     uri: Annotated[str, "The URI of the document to remove"],
 ) -> bool:
     """Remove a document from the RAG database."""
-    object_storage = build_object_storage_client(context)
-    database = build_database_client(context)
-    with object_storage.with_locked_and_downloaded_file(database.db_path) as f:
+    with with_database(context) as database:
         database.remove_document(collection_name, uri)
 
     return True
@@ -101,9 +142,7 @@ def get_rag_document(
     uri: Annotated[str, "The URI of the document to get"],
 ) -> Document | None:
     """Get a document from the RAG database."""
-    object_storage = build_object_storage_client(context)
-    database = build_database_client(context)
-    with object_storage.with_locked_and_downloaded_file(database.db_path) as f:
+    with with_database(context, read_only=True) as database:
         return database.get_document(collection_name, uri)
 
 
@@ -114,12 +153,18 @@ def find_relevant_documents(
     query: Annotated[str, "The plain-text search term to find relevant documents about"],
     limit: Annotated[int, "The maximum number of documents to return"] = 10,
     min_score: Annotated[float, "The minimum score of the documents to return"] = 0.5,
+    search_mode: Annotated[
+        SearchMode,
+        "How to search: 'vector' finds documents with similar meaning, 'keyword' finds exact words "
+        "such as IDs, error codes and names, and 'hybrid' combines both.  "
+        "Keyword and hybrid search only work on collections with a full-text index",
+    ] = "vector",
 ) -> list[Document]:
     """Find documents in the RAG database that are relevant to the query."""
-    object_storage = build_object_storage_client(context)
-    database = build_database_client(context)
-    with object_storage.with_locked_and_downloaded_file(database.db_path) as f:
-        return database.find_relevant_documents(collection_name, query, limit, min_score)
+    with with_database(context, read_only=True) as database:
+        return database.find_relevant_documents(
+            collection_name, query, limit, min_score, search_mode
+        )
 
 
 def build_object_storage_client(context: ToolContext):
@@ -131,6 +176,39 @@ def build_object_storage_client(context: ToolContext):
     )
 
 
-def build_database_client(context: ToolContext):
-    return DuckDBDatabase(context.get_secret("RAG_DATABASE_FILE"))
+def build_database_client(db_path: str, read_only: bool = False):
+    return DuckDBDatabase(db_path, read_only=read_only)
 
+
+@contextmanager
+def with_database(context: ToolContext, read_only: bool = False) -> Iterator[Database]:
+    """
+    Connect to a local copy of the RAG database.
+    Unless the database is opened read-only, it is synced back to object storage when done.
+    A sharded database only downloads, and syncs back, the files of the collections used.
+    """
+    object_storage = build_object_storage_client(context)
+    remote_path = context.get_secret("RAG_DATABASE_FILE")
+    if SHARDED_DATABASE:
+        with ExitStack() as exit_stack:
+            database: Database = ShardedDatabase(
+                object_storage, remote_path, exit_stack, read_only=read_only
+            )
+            database.connect()
+            try:
+                yield database
+            finally:
+                database.disconnect()
+        return
+
+    with (
+        object_storage.with_downloaded_file(remote_path)
+        if read_only
+        else object_storage.with_locked_and_downloaded_file(remote_path)
+    ) as local_path:
+        database = build_database_client(local_path, read_only=read_only)
+        database.connect()
+        try:
+            yield database
+        finally:
+            database.disconnect()
@@ -0,0 +1,13 @@
+import shutil
+import uuid
+
+import pytest
+
+from tests.test_object_storage import TEST_DIR, LocalObjectStorage
+
+
+@pytest.fixture(scope="function")
+def storage():
+    root = f"{TEST_DIR}/{uuid.uuid4()}"
+    yield LocalObjectStorage(root)
+    shutil.rmtree(root)
@@ -1,9 +1,13 @@
 import os
+from contextlib import ExitStack
 
 import pytest
 from duckdb import Error as DuckDBError
 
-from arcade_rag.databases.duckdb import DuckDBDatabase
+from arcade_rag.database import DocumentInput
+from arcade_rag.databases.duckdb import DuckDBDatabase, DuckDBEmbeddingStore
+from arcade_rag.embedder import embed_texts, embedding_cache, get_backend
+from tests.test_object_storage import LocalObjectStorage
 
 TEST_DIR = "/tmp/rag"  # noqa: S108
 TEST_DB_PATH = f"{TEST_DIR}/test.duckdb"
@@ -136,3 +140,365 @@ def test_find_relevant_documents(db: DuckDBDatabase):
     assert len(results) == 2
     assert results[0].uri == "http://books.com/the_count_of_monte_christo"
     assert results[1].uri == "http://books.com/20000_leagues_under_the_sea"
+
+
+def test_read_only_connection(db: DuckDBDatabase):
+    db.add_collection("test_collection")
+    db.add_document("test_collection", "uri_1", "title_1", "body_1", "summary_1", {"key": "value"})
+    db.disconnect()
+
+    read_only_db = DuckDBDatabase(TEST_DB_PATH, read_only=True)
+    read_only_db.connect()
+    doc = read_only_db.get_document("test_collection", "uri_1")
+    assert doc is not None
+    assert doc.title == "title_1"
+    with pytest.raises(DuckDBError):
+        read_only_db.add_collection("another_collection")
+    read_only_db.disconnect()
+
+    db.connect()
+
+
+def test_reads_see_writes_while_older_reads_are_open(storage: LocalObjectStorage):
+    def add_document(uri: str):
+        with storage.with_locked_and_downloaded_file("db.duckdb") as local_path:
+            writer = DuckDBDatabase(local_path)
+            writer.connect()
+            if not writer.check_collection_exists("test_collection"):
+                writer.add_collection("test_collection")
+            writer.add_document("test_collection", uri, "title", "body", "summary", {})
+            writer.disconnect()
+
+    def open_reader(stack: ExitStack) -> DuckDBDatabase:
+        reader = DuckDBDatabase(
+            stack.enter_context(storage.with_downloaded_file("db.duckdb")), read_only=True
+        )
+        reader.connect()
+        stack.callback(reader.disconnect)
+        return reader
+
+    add_document("uri_1")
+    with ExitStack() as stack:
+        old_reader = open_reader(stack)
+        add_document("uri_2")
+        # DuckDB reuses an open database for a path, so the new version must have its own path
+        new_reader = open_reader(stack)
+        assert new_reader.get_document("test_collection", "uri_2") is not None
+        assert old_reader.get_document("test_collection", "uri_2") is None
+
+
+def test_read_only_connection_to_missing_file():
+    read_only_db = DuckDBDatabase(f"{TEST_DIR}/missing.duckdb", read_only=True)
+    read_only_db.connect()
+    assert read_only_db.list_collections() == []
+    read_only_db.disconnect()
+
+
+def test_add_documents(db: DuckDBDatabase):
+    db.add_collection("test_collection")
+    db.add_document("test_collection", "uri_1", "title_1", "body_1", "summary_1", {"key": "value"})
+    first = db.get_document("test_collection", "uri_1")
+    assert first is not None
+
+    count = db.add_documents(
+        "test_collection",
+        [
+            DocumentInput(uri="uri_1", title="title_1b", body="body_1b", metadata={"a": 1}),
+            DocumentInput(uri="uri_2", title="title_2", body="body_2"),
+            DocumentInput(uri="uri_3", title="title_3", body="body_3"),
+            DocumentInput(uri="uri_3", title="title_3b", body="body_3b"),
+        ],
+        batch_size=2,
+    )
+    assert count == 3
+
+    rows = db.connection.execute("SELECT COUNT(*) FROM test_collection").fetchone()
+    assert rows is not None
+    assert rows[0] == 3
+
+    doc = db.get_document("test_collection", "uri_1")
+    assert doc is not None
+    assert doc.title == "title_1b"
+    assert doc.metadata == {"a": 1}
+    assert doc.created_at == first.created_at
+
+    doc = db.get_document("test_collection", "uri_3")
+    assert doc is not None
+    assert doc.title == "title_3b"
+
+
+def test_add_documents_is_atomic(db: DuckDBDatabase, monkeypatch: pytest.MonkeyPatch):
+    db.add_collection("test_collection")
+
+    calls = []
+
+    def failing_embed_texts(texts: list[str], **kwargs):
+        calls.append(texts)
+        if len(calls) > 1:
+            error_message = "embedding failed"
+            raise RuntimeError(error_message)
+        return embed_texts(texts, **kwargs)
+
+    monkeypatch.setattr("arcade_rag.databases.duckdb.embed_texts", failing_embed_texts)
+    with pytest.raises(RuntimeError):
+        db.add_documents(
+            "test_collection",
+            [DocumentInput(uri=f"uri_{i}", title="title", body="body") for i in range(3)],
+            batch_size=2,
+        )
+
+    assert len(calls) == 2
+    assert db.get_document("test_collection", "uri_0") is None
+
+
+def test_ann_index(db: DuckDBDatabase):
+    db.disconnect()
+    ann_db = DuckDBDatabase(TEST_DB_PATH, ann_index=True)
+    ann_db.connect()
+
+    ann_db.add_collection("test_collection")
+    ann_db.add_collection("another_collection")
+    assert ann_db.check_ann_index_exists("test_collection") is True
+    ann_db.add_documents(
+        "test_collection",
+        [
+            DocumentInput(
+                uri=f"uri_{i}",
+                title=f"title_{i}",
+                body=f"document number {i}",
+                summary=f"summary of document {i}",
+            )
+            for i in range(20)
+        ],
+    )
+    ann_db.remove_document("test_collection", "uri_3")
+    ann_db.disconnect()
+
+    # The index is persisted and used by read-only connections
+    read_only_db = DuckDBDatabase(TEST_DB_PATH, read_only=True)
+    read_only_db.connect()
+    assert read_only_db.check_ann_index_exists("test_collection") is True
+    results = read_only_db.find_relevant_documents("test_collection", "document number 3", limit=3)
+    assert len(results) == 3
+    assert "uri_3" not in [result.uri for result in results]
+    read_only_db.disconnect()
+
+    db.connect()
+    assert db.check_ann_index_exists("test_collection") is True
+
+
+def test_persistent_embedding_cache(db: DuckDBDatabase, monkeypatch: pytest.MonkeyPatch):
+    db.embedding_store = DuckDBEmbeddingStore(db)
+    db.add_collection("test_collection")
+    db.add_document("test_collection", "uri_1", "title_1", "body_1", "summary_1", {"key": "value"})
+    assert db.list_collections() == ["test_collection"]
+
+    # With the in-memory cache cleared, the embeddings come from the database
+    embedding_cache.clear()
+    encoded = []
+    monkeypatch.setattr(get_backend(), "encode", lambda texts, **kwargs: encoded.append(texts))
+    db.add_document("test_collection", "uri_2", "title_2", "body_1", "summary_1", {"key": "value"})
+    assert encoded == []
+
+    doc = db.get_document("test_collection", "uri_2")
+    assert doc is not None
+
+
+def test_add_documents_replacing_chunks(db: DuckDBDatabase):
+    db.add_collection("test_collection")
+    db.add_documents(
+        "test_collection",
+        [DocumentInput(uri="uri_1", title="t", body=f"old {i}", chunk_id=i) for i in range(3)],
+    )
+
+    chunks = (DocumentInput(uri="uri_1", title="t", body=f"new {i}", chunk_id=i) for i in range(2))
+    assert db.add_documents("test_collection", chunks, replace=True, batch_size=1) == 2
+    rows = db.connection.execute(
+        "SELECT chunk_id, body FROM test_collection ORDER BY chunk_id"
+    ).fetchall()
+    assert rows == [(0, "new 0"), (1, "new 1")]
+
+    # Chunks which have been written to disk are replaced too
+    db.disconnect()
+    db.connect()
+    chunks = (
+        DocumentInput(uri="uri_1", title="t", body=f"newer {i}", chunk_id=i) for i in range(3)
+    )
+    assert db.add_documents("test_collection", chunks, replace=True) == 3
+    rows = db.connection.execute(
+        "SELECT chunk_id, body FROM test_collection ORDER BY chunk_id"
+    ).fetchall()
+    assert rows == [(0, "newer 0"), (1, "newer 1"), (2, "newer 2")]
+
+
+def test_keyword_and_hybrid_search(db: DuckDBDatabase):
+    db.add_collection("test_collection")
+    with pytest.raises(ValueError):
+        db.find_relevant_documents("test_collection", "E1234", search_mode="keyword")
+
+    db.add_fts_index("test_collection")
+    db.add_documents(
+        "test_collection",
+        [
+            DocumentInput(uri="uri_1", title="Crash report", body="The server failed with E1234."),
+            DocumentInput(uri="uri_2", title="Release notes", body="Servers start faster."),
+            DocumentInput(uri="uri_3", title="Recipe", body="Bake the bread for an hour."),
+        ],
+    )
+    assert "fts_main_test_collection" not in db.list_collections()
+
+    docs = db.find_relevant_documents("test_collection", "E1234", search_mode="keyword")
+    assert [doc.uri for doc in docs] == ["uri_1"]
+    docs = db.find_relevant_documents("test_collection", "servers", search_mode="keyword")
+    assert {doc.uri for doc in docs} == {"uri_1", "uri_2"}
+
+    docs = db.find_relevant_documents("test_collection", "E1234", limit=2, search_mode="hybrid")
+    assert len(docs) == 2
+    assert docs[0].uri == "uri_1"
+    assert docs[0].score > docs[1].score
+
+    # The index follows writes
+    db.remove_document("test_collection", "uri_1")
+    assert db.find_relevant_documents("test_collection", "E1234", search_mode="keyword") == []
+
+
+def test_full_text_index_is_rebuilt_once_after_writes(db: DuckDBDatabase, monkeypatch):
+    db.add_collection("test_collection")
+    db.add_fts_index("test_collection")
+    rebuilds = []
+    add_fts_index = db.add_fts_index
+    monkeypatch.setattr(
+        db, "add_fts_index", lambda name: rebuilds.append(name) or add_fts_index(name)
+    )
+
+    for i in range(3):
+        db.add_documents(
+            "test_collection", [DocumentInput(uri=f"uri_{i}", title="t", body=f"word{i}")]
+        )
+    db.remove_document("test_collection", "uri_0")
+    assert rebuilds == []
+
+    assert db.find_relevant_documents("test_collection", "word1", search_mode="keyword")
+    db.find_relevant_documents("test_collection", "word2", search_mode="keyword")
+    assert rebuilds == ["test_collection"]
+
+    # Writes left at the end of the session are indexed before the file is closed
+    db.add_document("test_collection", "uri_3", "t", "word3", "", {})
+    db.disconnect()
+    assert rebuilds == ["test_collection", "test_collection"]
+
+    read_only_db = DuckDBDatabase(TEST_DB_PATH, read_only=True)
+    read_only_db.connect()
+    docs = read_only_db.find_relevant_documents("test_collection", "word3", search_mode="keyword")
+    assert [doc.uri for doc in docs] == ["uri_3"]
+    read_only_db.disconnect()
+    db.connect()
+
+
+def test_get_document_returns_first_chunk(db: DuckDBDatabase):
+    db.add_collection("test_collection")
+    db.add_documents(
+        "test_collection",
+        [
+            DocumentInput(uri="uri_1", title="t", body="second", metadata={"n": 1}, chunk_id=1),
+            DocumentInput(uri="uri_1", title="t", body="first", metadata={"n": 0}, chunk_id=0),
+        ],
+    )
+    doc = db.get_document("test_collection", "uri_1")
+    assert doc is not None
+    assert (doc.body, doc.chunk_id, doc.metadata, doc.score) == ("first", 0, {"n": 0}, None)
+
+
+def test_find_relevant_documents_weights_field_scores(db: DuckDBDatabase):
+    db.add_collection("test_collection")
+    db.add_documents(
+        "test_collection",
+        [
+            DocumentInput(
+                uri=f"uri_{i}", title=f"title_{i}", body=f"document number {i}", summary=f"s{i}"
+            )
+            for i in range(10)
+        ],
+    )
+
+    docs = db.find_relevant_documents("test_collection", "document number 3", limit=3, min_score=-3)
+    assert len(docs) == 3
+    assert [doc.score for doc in docs] == sorted([doc.score for doc in docs], reverse=True)
+    for doc in docs:
+        assert doc.score == pytest.approx(doc.body_score + doc.summary_score + doc.metadata_score)
+    db.disconnect()
+
+    body_db = DuckDBDatabase(TEST_DB_PATH, score_weights={"summary": 0, "metadata": 0.5})
+    body_db.connect()
+    docs = body_db.find_relevant_documents(
+        "test_collection", "document number 3", limit=10, min_score=-3
+    )
+    assert len(docs) == 10
+    for doc in docs:
+        assert doc.summary_score is None
+        assert doc.score == pytest.approx(doc.body_score + 0.5 * doc.metadata_score)
+    body_db.disconnect()
+    db.connect()
+
+    with pytest.raises(ValueError):
+        DuckDBDatabase(TEST_DB_PATH, score_weights={"body": 0, "summary": 0, "metadata": 0})
+
+
+@pytest.mark.parametrize("embedding_storage", ["normalized", "int8"])
+def test_embedding_storage(db: DuckDBDatabase, embedding_storage: str):
+    documents = [
+        DocumentInput(uri=f"uri_{i}", title=f"title_{i}", body=f"document number {i}")
+        for i in range(10)
+    ]
+    db.add_collection("float_collection")
+    db.add_documents("float_collection", documents)
+    db.disconnect()
+
+    storage_db = DuckDBDatabase(TEST_DB_PATH, embedding_storage=embedding_storage)
+    storage_db.connect()
+    storage_db.add_collection("test_collection")
+    storage_db.add_documents("test_collection", documents)
+    storage_db.disconnect()
+
+    # Reads tell how each collection's embeddings are stored, whatever the database's option
+    db.connect()
+    assert (
+        db.connection.execute(
+            "SELECT data_type FROM duckdb_columns() WHERE table_name = ? AND column_name = ?",
+            ["test_collection", "body_embedding"],
+        )
+        .fetchone()[0]
+        .startswith("TINYINT" if embedding_storage == "int8" else "FLOAT")
+    )
+
+    expected = db.find_relevant_documents("float_collection", "document 3", limit=10, min_score=-3)
+    docs = db.find_relevant_documents("test_collection", "document 3", limit=10, min_score=-3)
+    tolerance = 0.05 if embedding_storage == "int8" else 1e-5
+    assert {doc.uri: doc.score for doc in docs} == pytest.approx(
+        {doc.uri: doc.score for doc in expected}, abs=tolerance
+    )
+
+
+def test_int8_embedding_storage_has_no_ann_index():
+    with pytest.raises(ValueError):
+        DuckDBDatabase(TEST_DB_PATH, ann_index=True, embedding_storage="int8")
+
+
+def test_normalized_embedding_storage_ann_index(db: DuckDBDatabase):
+    db.disconnect()
+    ann_db = DuckDBDatabase(TEST_DB_PATH, ann_index=True, embedding_storage="normalized")
+    ann_db.connect()
+    ann_db.add_collection("test_collection")
+    ann_db.add_documents(
+        "test_collection",
+        [
+            DocumentInput(uri=f"uri_{i}", title=f"title_{i}", body=f"document number {i}")
+            for i in range(20)
+        ],
+    )
+    results = ann_db.find_relevant_documents(
+        "test_collection", "document number 3", limit=3, min_score=-3
+    )
+    assert len(results) == 3
+    ann_db.disconnect()
+    db.connect()
@@ -0,0 +1,132 @@
+import threading
+from contextlib import ExitStack
+
+import pytest
+
+from arcade_rag.database import DocumentInput
+from arcade_rag.databases.sharded import ShardedDatabase
+from tests.test_object_storage import LocalObjectStorage
+
+MANIFEST_PATH = "rag/manifest.json"
+
+
+def open_database(storage: LocalObjectStorage, stack: ExitStack, **kwargs) -> ShardedDatabase:
+    database = ShardedDatabase(storage, MANIFEST_PATH, stack, **kwargs)
+    database.connect()
+    return database
+
+
+def test_collections_are_listed_in_the_manifest(storage: LocalObjectStorage):
+    with ExitStack() as stack:
+        db = open_database(storage, stack, shards=3)
+        db.add_collection("first")
+        db.add_collection("second")
+        with pytest.raises(ValueError):
+            db.add_collection("first")
+
+    with ExitStack() as stack:
+        db = open_database(storage, stack, read_only=True)
+        assert db.list_collections() == ["first", "second"]
+        assert db.find_relevant_documents("first", "anything") == []
+        with pytest.raises(ValueError):
+            db.add_collection("third")
+
+    with ExitStack() as stack:
+        db = open_database(storage, stack)
+        db.remove_collection("first")
+        assert db.list_collections() == ["second"]
+        assert not db.check_collection_exists("first")
+
+
+def test_documents_are_hash_partitioned_into_shards(storage: LocalObjectStorage):
+    with ExitStack() as stack:
+        db = open_database(storage, stack, shards=3)
+        db.add_collection("test_collection")
+        db.add_collection("other_collection")
+        count = db.add_documents(
+            "test_collection",
+            [
+                DocumentInput(uri=f"uri_{i}", title=f"title_{i}", body=f"document number {i}")
+                for i in range(30)
+            ],
+            batch_size=7,
+        )
+        assert count == 30
+    # The manifest twice, and each shard of the collection written to, but not the other one
+    assert storage.uploads == 2 + 3
+
+    # As if in a new process, with no local replicas
+    storage._replicas.clear()
+    with ExitStack() as stack:
+        db = open_database(storage, stack, read_only=True)
+        doc = db.get_document("test_collection", "uri_4")
+        assert doc is not None
+        assert doc.body == "document number 4"
+        # Only the manifest and the document's shard are downloaded
+        assert storage.downloads == 2
+
+        docs = db.find_relevant_documents("test_collection", "document", limit=40, min_score=-3)
+        assert sorted(doc.uri for doc in docs) == sorted(f"uri_{i}" for i in range(30))
+        assert [doc.score for doc in docs] == sorted([doc.score for doc in docs], reverse=True)
+
+
+def test_replacing_documents_across_batches(storage: LocalObjectStorage):
+    with ExitStack() as stack:
+        db = open_database(storage, stack, shards=2)
+        db.add_collection("test_collection")
+        db.add_documents(
+            "test_collection",
+            [DocumentInput(uri="doc", title="t", body=f"old {i}", chunk_id=i) for i in range(5)],
+        )
+
+    with ExitStack() as stack:
+        db = open_database(storage, stack)
+        db.add_documents(
+            "test_collection",
+            [DocumentInput(uri="doc", title="t", body=f"new {i}", chunk_id=i) for i in range(3)],
+            replace=True,
+            batch_size=2,
+        )
+        db.remove_document("test_collection", "missing")
+
+    with ExitStack() as stack:
+        db = open_database(storage, stack, read_only=True)
+        docs = db.find_relevant_documents("test_collection", "new", limit=10, min_score=-3)
+        assert sorted(doc.body for doc in docs) == ["new 0", "new 1", "new 2"]
+
+
+def test_failed_writes_are_not_uploaded(storage: LocalObjectStorage):
+    with ExitStack() as stack:
+        db = open_database(storage, stack)
+        db.add_collection("test_collection")
+    uploads = storage.uploads
+
+    with pytest.raises(RuntimeError), ExitStack() as stack:
+        db = open_database(storage, stack)
+        db.add_document("test_collection", "uri", "title", "body", "summary", {})
+        raise RuntimeError
+
+    assert storage.uploads == uploads
+
+
+def test_removing_a_collection_waits_for_its_writers(storage: LocalObjectStorage):
+    with ExitStack() as stack:
+        db = open_database(storage, stack)
+        db.add_collection("test_collection")
+        db.add_document("test_collection", "uri", "title", "body", None, None)
+    shard_path = db._get_shard_paths("test_collection")[0]
+
+    def remove_collection():
+        with ExitStack() as stack:
+            open_database(storage, stack).remove_collection("test_collection")
+        removed.set()
+
+    removed = threading.Event()
+    with storage.with_lease(shard_path):
+        thread = threading.Thread(target=remove_collection)
+        thread.start()
+        assert not removed.wait(0.3)
+        assert storage.get_remote_metadata(shard_path) is not None
+    thread.join()
+    assert removed.is_set()
+    assert storage.get_remote_metadata(shard_path) is None
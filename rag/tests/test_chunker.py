@@ -0,0 +1,31 @@
+from itertools import pairwise
+
+import pytest
+
+from arcade_rag.chunker import chunk_text
+from arcade_rag.embedder import get_backend
+
+
+def test_short_text_is_one_chunk():
+    assert chunk_text("A short text.", max_tokens=50) == ["A short text."]
+    assert chunk_text("  ", max_tokens=50) == []
+
+
+def test_chunks_are_token_bounded_and_overlap():
+    text = " ".join(f"Sentence number {i} is here." for i in range(100))
+    chunks = chunk_text(text, max_tokens=40, overlap_tokens=8)
+
+    assert len(chunks) > 1
+    backend = get_backend()
+    assert all(len(backend.get_token_offsets(chunk)) <= 40 for chunk in chunks)
+    # Chunks break between words, and each starts with the end of the previous one
+    for previous, chunk in pairwise(chunks):
+        first_word = chunk.split()[0]
+        assert first_word in previous.split()[-10:]
+    assert chunks[0].startswith("Sentence number 0")
+    assert chunks[-1].endswith("Sentence number 99 is here.")
+
+
+def test_overlap_must_be_smaller_than_chunks():
+    with pytest.raises(ValueError):
+        chunk_text("text", max_tokens=10, overlap_tokens=10)
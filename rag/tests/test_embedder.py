@@ -1,6 +1,66 @@
-from arcade_rag.embedder import MODEL_VEC_SIZE, embed_text
+import numpy as np
+import pytest
+
+from arcade_rag.embedder import (
+    EmbeddingCache,
+    embed_text,
+    embed_texts,
+    embedding_cache,
+    get_backend,
+    get_model_vec_size,
+)
 
 
 def test_embedder():
     result = embed_text("hello world")
-    assert len(result) == MODEL_VEC_SIZE
+    assert len(result) == get_model_vec_size()
+
+
+def test_embed_texts():
+    result = embed_texts(["hello world", "goodbye world", "hello world"], batch_size=2)
+    assert result.shape == (3, get_model_vec_size())
+    assert result.dtype == np.float32
+    assert result.flags["C_CONTIGUOUS"]
+    assert np.allclose(result[0], result[2], atol=1e-5)
+    assert np.allclose(result[0], embed_text("hello world"), atol=1e-5)
+
+
+def test_embed_texts_empty():
+    assert embed_texts([]).shape == (0, get_model_vec_size())
+
+
+def test_embed_texts_uses_the_cache(monkeypatch: pytest.MonkeyPatch):
+    embedding_cache.clear()
+    encoded: list[list[str]] = []
+    backend = get_backend()
+    encode = backend.encode
+
+    def counting_encode(texts: list[str], **kwargs):
+        encoded.append(texts)
+        return encode(texts, **kwargs)
+
+    monkeypatch.setattr(backend, "encode", counting_encode)
+
+    first = embed_texts(["hello world", "hello world", "goodbye world"])
+    assert encoded == [["hello world", "goodbye world"]]
+
+    second = embed_texts(["goodbye world", "hello world", "hello again"])
+    assert encoded[1] == ["hello again"]
+    assert np.array_equal(first[2], second[0])
+    assert np.array_equal(first[0], second[1])
+
+
+def test_embedding_cache_evicts_least_recently_used():
+    cache = EmbeddingCache(max_size=2)
+    cache.put("a", np.zeros(1))
+    cache.put("b", np.zeros(1))
+    assert cache.get("a") is not None
+    cache.put("c", np.zeros(1))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_model_is_shared():
+    assert get_backend() is get_backend()
+    assert get_model_vec_size() == get_backend().dimension
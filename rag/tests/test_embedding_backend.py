@@ -0,0 +1,37 @@
+import pytest
+
+from arcade_rag.embedder import MODEL_NAME
+from arcade_rag.embedding_backend import build_embedding_backend, check_backend_parity
+
+TEXTS = [
+    "hello world",
+    "Alice as a little girl goes on an adventure in Wonderland.",
+    "Captain Nemo is a mysterious man who lives on a submarine.",
+    '{"author": "Alexandre Dumas", "year": 1844, "genre": "adventure", "country": "France"}',
+]
+
+
+@pytest.fixture(scope="module")
+def torch_backend():
+    return build_embedding_backend("torch", MODEL_NAME)
+
+
+def test_torch_backend(torch_backend):
+    embeddings = torch_backend.encode(TEXTS, batch_size=2)
+    assert embeddings.shape == (len(TEXTS), torch_backend.dimension)
+    assert embeddings.dtype == "float32"
+
+
+@pytest.mark.parametrize(("backend_name", "min_similarity"), [("onnx", 0.999), ("onnx-int8", 0.95)])
+def test_backend_parity(torch_backend, backend_name: str, min_similarity: float):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("optimum")
+
+    backend = build_embedding_backend(backend_name, MODEL_NAME)
+    assert backend.dimension == torch_backend.dimension
+    assert check_backend_parity(backend, torch_backend, TEXTS) >= min_similarity
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        build_embedding_backend("abacus", MODEL_NAME)
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from arcade_rag.databases.duckdb import DuckDBDatabase
+from arcade_rag.ingestion import iter_document_chunks
+
+pytest.importorskip("arcade_parse")
+
+TEST_DB_PATH = "/tmp/rag/test_ingestion.duckdb"  # noqa: S108
+ALICE_PATH = os.path.join(
+    os.path.dirname(__file__), "../../parse/tests/files/Alice_in_Wonderland.pdf"
+)
+
+
+@pytest.mark.skipif(not os.path.exists(ALICE_PATH), reason="arcade_parse's test files are missing")
+def test_ingest_document():
+    chunks = iter_document_chunks(ALICE_PATH, metadata={"source": "test"})
+    first = next(chunks)
+    assert first.chunk_id == 0
+    assert first.title == "Alice_in_Wonderland.pdf"
+    assert first.metadata == {"source": "test", "page": 1}
+
+    os.makedirs(os.path.dirname(TEST_DB_PATH), exist_ok=True)
+    if os.path.exists(TEST_DB_PATH):
+        os.remove(TEST_DB_PATH)
+    db = DuckDBDatabase(TEST_DB_PATH)
+    db.connect()
+    try:
+        db.add_collection("books")
+        count = db.add_documents("books", iter_document_chunks(ALICE_PATH), replace=True)
+        assert count > 100
+        chunk_ids = [
+            row[0]
+            for row in db.connection.execute(
+                "SELECT chunk_id FROM books WHERE uri = ? ORDER BY chunk_id", [ALICE_PATH]
+            ).fetchall()
+        ]
+        assert chunk_ids == list(range(count))
+    finally:
+        db.disconnect()
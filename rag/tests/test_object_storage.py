@@ -0,0 +1,272 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from functools import partial
+
+import pytest
+
+from arcade_rag.object_storage import LOCK_SUFFIX, ObjectStorage, RemoteFileMetadata
+
+TEST_DIR = "/tmp/rag/remote"  # noqa: S108
+
+
+class LocalObjectStorage(ObjectStorage):
+    """An object storage backed by a local directory, which counts transfers."""
+
+    def __init__(self, root: str, client_id: str | None = None):
+        self.root = root
+        if client_id is not None:
+            # Like a separate process: the same remote files and REPLICA_DIR, but none of the
+            # process-wide locks and replicas
+            self._replicas = {}
+            self._locks = {}
+            self._locks_guard = threading.Lock()
+            self._replica_readers = {}
+            self._superseded_replicas = set()
+        self.downloads = 0
+        self.uploads = 0
+        # Makes conditional writes atomic, as the storage service would
+        self.condition_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def storage_id(self) -> str:
+        return f"file://{self.root}"
+
+    def upload_file(self, local_path: str, remote_path: str) -> bool:
+        self.uploads += 1
+        os.makedirs(os.path.dirname(os.path.join(self.root, remote_path)), exist_ok=True)
+        shutil.copyfile(local_path, os.path.join(self.root, remote_path))
+        return True
+
+    def download_file(self, remote_path: str, local_path: str) -> bool:
+        if not os.path.exists(os.path.join(self.root, remote_path)):
+            return False
+        self.downloads += 1
+        shutil.copyfile(os.path.join(self.root, remote_path), local_path)
+        return True
+
+    def delete_remote_file(self, remote_path: str) -> bool:
+        os.remove(os.path.join(self.root, remote_path))
+        return True
+
+    def read_remote_file(self, remote_path: str) -> tuple[bytes, RemoteFileMetadata] | None:
+        metadata = self.get_remote_metadata(remote_path)
+        if metadata is None:
+            return None
+        with open(os.path.join(self.root, remote_path), "rb") as f:
+            return f.read(), metadata
+
+    def write_remote_file_if(
+        self, remote_path: str, content: bytes, etag: str | None
+    ) -> RemoteFileMetadata | None:
+        with self.condition_lock:
+            metadata = self.get_remote_metadata(remote_path)
+            if (metadata.etag if metadata else None) != etag:
+                return None
+            write_remote(self, remote_path, content)
+            return self.get_remote_metadata(remote_path)
+
+    def delete_remote_file_if(self, remote_path: str, etag: str) -> bool:
+        with self.condition_lock:
+            metadata = self.get_remote_metadata(remote_path)
+            if metadata is None or metadata.etag != etag:
+                return False
+            return self.delete_remote_file(remote_path)
+
+    def get_remote_metadata(self, remote_path: str) -> RemoteFileMetadata | None:
+        path = os.path.join(self.root, remote_path)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            content = f.read()
+        return RemoteFileMetadata(size=len(content), etag=hashlib.md5(content).hexdigest())  # noqa: S324
+
+
+def write_remote(storage: LocalObjectStorage, remote_path: str, content: bytes):
+    os.makedirs(os.path.dirname(os.path.join(storage.root, remote_path)), exist_ok=True)
+    with open(os.path.join(storage.root, remote_path), "wb") as f:
+        f.write(content)
+
+
+def test_replica_is_only_downloaded_when_remote_changes(storage: LocalObjectStorage):
+    write_remote(storage, "db.duckdb", b"first")
+
+    replica = storage.get_local_replica("db.duckdb")
+    storage.get_local_replica("db.duckdb")
+    assert storage.downloads == 1
+    with open(replica.local_path, "rb") as f:
+        assert f.read() == b"first"
+
+    write_remote(storage, "db.duckdb", b"second version")
+    replica = storage.get_local_replica("db.duckdb")
+    assert storage.downloads == 2
+    with open(replica.local_path, "rb") as f:
+        assert f.read() == b"second version"
+
+
+def test_superseded_replicas_are_removed_once_read(storage: LocalObjectStorage):
+    write_remote(storage, "db.duckdb", b"first")
+
+    with storage.with_downloaded_file("db.duckdb") as first_path:
+        write_remote(storage, "db.duckdb", b"second version")
+        with storage.with_downloaded_file("db.duckdb") as second_path:
+            assert second_path != first_path
+            # The first version is still being read
+            with open(first_path, "rb") as f:
+                assert f.read() == b"first"
+    assert not os.path.exists(first_path)
+    assert os.path.exists(second_path)
+
+
+def test_clients_sharing_replica_dir_do_not_lose_writes(storage: LocalObjectStorage):
+    write_remote(storage, "db.duckdb", b"v1")
+    writer = LocalObjectStorage(storage.root, client_id="writer")
+    writer.get_local_replica("db.duckdb")
+
+    # Another client downloads the first version, and is slow to finish
+    reader = LocalObjectStorage(storage.root, client_id="reader")
+    downloaded = threading.Event()
+    resume = threading.Event()
+
+    def download_file(remote_path: str, local_path: str) -> bool:
+        result = LocalObjectStorage.download_file(reader, remote_path, local_path)
+        downloaded.set()
+        resume.wait()
+        return result
+
+    reader.download_file = download_file  # type: ignore[method-assign]
+    thread = threading.Thread(target=reader.get_local_replica, args=("db.duckdb",))
+    thread.start()
+    downloaded.wait()
+
+    for line in (b"+A", b"+A2"):
+        with (
+            writer.with_locked_and_downloaded_file("db.duckdb") as local_path,
+            open(local_path, "ab") as f,
+        ):
+            f.write(line)
+        resume.set()
+        thread.join()
+
+    with open(os.path.join(storage.root, "db.duckdb"), "rb") as f:
+        assert f.read() == b"v1+A+A2"
+
+
+def test_missing_remote_file(storage: LocalObjectStorage):
+    replica = storage.get_local_replica("missing.duckdb")
+    assert replica.metadata is None
+    assert not os.path.exists(replica.local_path)
+
+
+def test_write_uploads_and_refreshes_replica(storage: LocalObjectStorage):
+    with storage.with_locked_and_downloaded_file("db.duckdb") as local_path:
+        assert not os.path.exists(local_path)
+        with open(local_path, "wb") as f:
+            f.write(b"created")
+
+    assert storage.uploads == 1
+    replica = storage.get_local_replica("db.duckdb")
+    assert storage.downloads == 0
+    with open(replica.local_path, "rb") as f:
+        assert f.read() == b"created"
+
+
+def test_write_conflict_raises(storage: LocalObjectStorage):
+    write_remote(storage, "db.duckdb", b"first")
+
+    with (
+        pytest.raises(ValueError),
+        storage.with_locked_and_downloaded_file("db.duckdb") as local_path,
+    ):
+        with open(local_path, "wb") as f:
+            f.write(b"mine")
+        write_remote(storage, "db.duckdb", b"someone else's")
+
+    assert storage.uploads == 0
+
+
+def test_read_only_access_never_uploads(storage: LocalObjectStorage):
+    write_remote(storage, "db.duckdb", b"first")
+
+    with storage.with_downloaded_file("db.duckdb") as local_path, open(local_path, "rb") as f:
+        assert f.read() == b"first"
+    with storage.with_downloaded_file("db.duckdb"):
+        pass
+
+    assert storage.downloads == 1
+    assert storage.uploads == 0
+
+
+def write_lease(storage: LocalObjectStorage, remote_path: str, expires_in: float):
+    """Take the lock of the remote file as another process would."""
+    content = {"owner": "another process", "expires_at": time.time() + expires_in}
+    write_remote(storage, f"{remote_path}{LOCK_SUFFIX}", json.dumps(content).encode())
+
+
+def test_lease_is_released(storage: LocalObjectStorage):
+    with storage.with_lease("db.duckdb") as lease:
+        assert os.path.exists(os.path.join(storage.root, f"db.duckdb{LOCK_SUFFIX}"))
+        lease.check()
+    assert not os.path.exists(os.path.join(storage.root, f"db.duckdb{LOCK_SUFFIX}"))
+
+
+def test_lease_waits_for_another_process(storage: LocalObjectStorage):
+    write_lease(storage, "db.duckdb", expires_in=60)
+    with pytest.raises(TimeoutError), storage.with_lease("db.duckdb", wait_seconds=0.3):
+        pass
+
+    # Another process's lease that was not renewed in time is taken over
+    write_lease(storage, "db.duckdb", expires_in=-1)
+    with storage.with_lease("db.duckdb", wait_seconds=0.3):
+        pass
+
+
+def test_lease_is_renewed_while_held(storage: LocalObjectStorage):
+    with storage.with_lease("db.duckdb", ttl_seconds=0.3) as lease:
+        time.sleep(0.6)
+        content, _ = storage.read_remote_file(f"db.duckdb{LOCK_SUFFIX}")
+        assert json.loads(content)["expires_at"] > time.time()
+        lease.check()
+
+
+def test_lost_lease_is_not_uploaded(storage: LocalObjectStorage, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(storage, "with_lease", partial(storage.with_lease, ttl_seconds=0.3))
+    with (
+        pytest.raises(ValueError),
+        storage.with_locked_and_downloaded_file("db.duckdb") as local_path,
+    ):
+        with open(local_path, "wb") as f:
+            f.write(b"mine")
+        # Another process takes the lock over, as if this one had stalled
+        write_lease(storage, "db.duckdb", expires_in=60)
+        time.sleep(0.3)
+
+    assert storage.uploads == 0
+
+
+def test_concurrent_writers_wait_for_each_other(storage: LocalObjectStorage):
+    write_remote(storage, "db.duckdb", b"")
+
+    def append(line: bytes):
+        # Each writer has its own storage client, like separate processes do, so only the
+        # lease on the remote lock object keeps them apart
+        writer_storage = LocalObjectStorage(storage.root, client_id=line.decode())
+        writer_storage.condition_lock = storage.condition_lock
+        with (
+            writer_storage.with_locked_and_downloaded_file("db.duckdb") as local_path,
+            open(local_path, "ab") as f,
+        ):
+            f.write(line)
+
+    threads = [threading.Thread(target=append, args=(b"%d," % i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(os.path.join(storage.root, "db.duckdb"), "rb") as f:
+        assert sorted(f.read().split(b",")[:-1]) == sorted(b"%d" % i for i in range(8))
@@ -1,23 +1,168 @@
-from typing import Annotated, Any, Literal
+import asyncio
+import atexit
+import csv
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Annotated, Any, Literal, TypeVar
 
 from arcade.sdk import ToolContext, tool
 from arcade.sdk.errors import RetryableToolError
-from sqlalchemy import Engine, create_engine, inspect, text
+from sqlalchemy import URL, Connection, Row, bindparam, event, inspect, make_url, text
+from sqlalchemy.engine.interfaces import ReflectedColumn
+from sqlalchemy.engine.reflection import ObjectKind
+from sqlalchemy.exc import NoSuchTableError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+
+T = TypeVar("T")
+
+# Engines (and their connection pools) are shared by every tool call in the worker,
+# keyed by connection string and isolation level
+POOL_SIZE = int(os.getenv("SQL_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("SQL_POOL_MAX_OVERFLOW", "5"))
+POOL_RECYCLE_SECONDS = int(os.getenv("SQL_POOL_RECYCLE_SECONDS", "300"))
+
+# Connection strings usually name a synchronous driver (or none), which is swapped for the
+# dialect's asyncio driver so that tool calls do not block the worker while they wait
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite", "mysql": "aiomysql"}
+# asyncpg takes libpq's `sslmode` as its `ssl` argument, with the same values. It reads the
+# certificate files from libpq's environment variables (PGSSLROOTCERT etc.), not from the URL.
+ASYNCPG_SSL_MODES = {"disable", "allow", "prefer", "require", "verify-ca", "verify-full"}
+LIBPQ_SSL_FILE_PARAMETERS = {"sslcert", "sslkey", "sslrootcert", "sslcrl", "sslpassword"}
+
+# Each engine belongs to the event loop it was created in
+_engines: dict[tuple[str, str], tuple[asyncio.AbstractEventLoop, AsyncEngine]] = {}
+_engines_lock = threading.Lock()
+
+# Tool calls are cancelled just before the worker's own timeout (`timeout = 30` in worker.toml),
+# so that the agent gets a useful error instead of a dropped call
+TOOL_TIMEOUT_SECONDS = float(os.getenv("SQL_TOOL_TIMEOUT_SECONDS", "28"))
+# Statements are also cancelled by the database itself, which frees the connection and
+# the database's resources even if the client has gone away
+STATEMENT_TIMEOUT_SECONDS = float(os.getenv("SQL_STATEMENT_TIMEOUT_SECONDS", "25"))
+STATEMENT_TIMEOUT_COMMANDS = {
+    "postgresql": "SET statement_timeout = {milliseconds}",
+    "mysql": "SET SESSION max_execution_time = {milliseconds}",
+}
+
+# Query results are streamed from the database, and cut off at these limits
+MAX_RESULT_ROWS = int(os.getenv("SQL_MAX_RESULT_ROWS", "1000"))
+MAX_RESULT_BYTES = int(os.getenv("SQL_MAX_RESULT_BYTES", str(256 * 1024)))
+STREAM_BATCH_SIZE = 500
+# "rows" gives each row as a Python tuple, and "csv" gives a header line and a line of CSV per row
+RESULT_FORMATS = Literal["rows", "csv"]
+
+# Queries which the database's planner estimates to be more expensive than this are not run.
+# Costs are in the planner's own units; 0 turns the check off.
+MAX_QUERY_COST = float(os.getenv("SQL_MAX_QUERY_COST", "0"))
+MAX_QUERY_ESTIMATED_ROWS = float(os.getenv("SQL_MAX_QUERY_ESTIMATED_ROWS", "0"))
+
+# How long reflected table and column metadata is reused before the database is asked again
+SCHEMA_CACHE_TTL_SECONDS = float(os.getenv("SQL_SCHEMA_CACHE_TTL_SECONDS", "300"))
+
+
+@dataclass
+class _SchemaReflection:
+    """The tables of a database schema and their columns, as reflected at `reflected_at`."""
+
+    tables: list[str]
+    columns: dict[str, list[ReflectedColumn]]
+    reflected_at: float = field(default_factory=time.monotonic)
+
+
+_schema_cache: dict[tuple[str, str], _SchemaReflection] = {}
+_schema_cache_lock = threading.Lock()
+
+# Results of read queries can be reused for a while, when the caller allows it. By default they
+# are not, as the data may change under the cache; writes made through these tools are tracked.
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("SQL_RESULT_CACHE_TTL_SECONDS", "0"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("SQL_RESULT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+@dataclass
+class _CachedResult:
+    rows: list[str]
+    tables: set[str]
+    """The tables the query reads from, as far as can be told from its text."""
+    size: int
+    expires_at: float
+
+
+class _ResultCache:
+    """A thread-safe LRU cache of query results, bounded by the total size of the results."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[tuple[str, str, int, str], _CachedResult] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple[str, str, int, str]) -> list[str] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry.rows
+
+    def put(self, key: tuple[str, str, int, str], rows: list[str], ttl_seconds: float) -> None:
+        size = len(key[1]) + sum(len(row) for row in rows)
+        if size > self.max_bytes:
+            return
+        entry = _CachedResult(
+            rows=rows,
+            tables=_get_query_tables(key[1]),
+            size=size,
+            expires_at=time.monotonic() + ttl_seconds,
+        )
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, connection_key: str | None = None, tables: set[str] | None = None) -> None:
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if connection_key not in (None, key[0]):
+                    continue
+                if tables is not None and not tables & entry.tables:
+                    continue
+                self._remove(key)
+
+    def _remove(self, key: tuple[str, str, int, str]) -> None:
+        self.size -= self._entries.pop(key).size
+
+
+_result_cache = _ResultCache(RESULT_CACHE_MAX_BYTES)
 
 
 @tool(requires_secrets=["DATABASE_CONNECTION_STRING"])
-def discover_tables(
+async def discover_tables(
     context: ToolContext,
     schema_name: Annotated[str, "The database schema to discover tables in"] = "public",
 ) -> list[str]:
     """Discover all the tables in the SQL database when the list of tables is not known"""
     engine = _get_engine(context.get_secret("DATABASE_CONNECTION_STRING"))
-    tables = _get_tables(engine, schema_name)
+    tables = await _with_timeout(_run_sync(engine, _get_tables, schema_name))
     return tables
 
 
 @tool(requires_secrets=["DATABASE_CONNECTION_STRING"])
-def get_table_schema(
+async def get_table_schema(
     context: ToolContext,
     schema_name: Annotated[str, "The database schema to get the table schema of"],
     table_name: Annotated[str, "The table to get the schema of"],
@@ -27,20 +172,79 @@ def get_table_schema(
     but the name of the table is provided
     """
     engine = _get_engine(context.get_secret("DATABASE_CONNECTION_STRING"))
-    return _get_table_schema(engine, schema_name, table_name)
+    return await _with_timeout(_run_sync(engine, _get_table_schema, schema_name, table_name))
+
+
+@tool(requires_secrets=["DATABASE_CONNECTION_STRING"])
+async def get_schemas(
+    context: ToolContext,
+    schema_name: Annotated[str, "The database schema the tables are in"] = "public",
+    table_names: Annotated[
+        list[str] | None, "The tables to describe.  If not provided, all tables are described"
+    ] = None,
+) -> list[str]:
+    """
+    Get the schemas of many tables in the SQL database at once, or of every table in a schema.
+    Each line describes one table: its approximate row count, and its columns with their types,
+    primary keys (PK) and foreign keys (FK -> table.column).
+    Prefer this tool to calling <GetTableSchema> for each table.
+    """
+    engine = _get_engine(context.get_secret("DATABASE_CONNECTION_STRING"))
+    return await _with_timeout(_run_sync(engine, _get_schemas, schema_name, table_names))
 
 
 @tool(requires_secrets=["DATABASE_CONNECTION_STRING"])
-def execute_query(
-    context: ToolContext, query: Annotated[str, "The SQL query to execute"]
+async def execute_query(
+    context: ToolContext,
+    query: Annotated[str, "The SQL query to execute"],
+    offset: Annotated[
+        int,
+        "The number of result rows to skip, to get the next page of a truncated result. "
+        "Pages only follow on from each other if the query has an ORDER BY",
+    ] = 0,
+    cache_ttl_seconds: Annotated[
+        float | None,
+        "How many seconds an earlier result of the same query may be reused for, "
+        "e.g. for counts or aggregates which do not need to be up to the second. "
+        "0 always runs the query",
+    ] = None,
+    result_format: Annotated[
+        RESULT_FORMATS,
+        "How to return each row: 'rows' gives Python tuples, and 'csv' gives a header line "
+        "of column names followed by a line of CSV per row, which is more compact",
+    ] = "rows",
 ) -> list[str]:
     """
     You have a connection to a SQL database.
     Execute a query and return the results against the SQL database
+    Large results are truncated, and the last row explains how to get the rest.
     """
     engine = _get_engine(context.get_secret("DATABASE_CONNECTION_STRING"))
+    if cache_ttl_seconds is None:
+        cache_ttl_seconds = RESULT_CACHE_TTL_SECONDS
+    # Only queries which read rows are cached
+    cache_key = None
+    if cache_ttl_seconds > 0 and _is_streamable(query):
+        cache_key = (_get_cache_key(engine.url), _normalize_query(query), offset, result_format)
+        rows = _result_cache.get(cache_key)
+        if rows is not None:
+            return rows
+
     try:
-        return _execute_query(engine, query)
+        # The cost check and the query share one deadline, within the worker's timeout
+        rows = await _with_timeout(
+            _check_and_execute_query(engine, query, offset=offset, result_format=result_format)
+        )
+    except RetryableToolError:
+        raise
+    # Before Python 3.11, asyncio.wait_for raises asyncio.TimeoutError, not the builtin
+    except asyncio.TimeoutError as e:
+        raise RetryableToolError(  # noqa: TRY003
+            f"Query did not finish within {TOOL_TIMEOUT_SECONDS:g} seconds",
+            developer_message=f"Query '{query}' timed out.",
+            additional_prompt_content="Make the query cheaper, e.g. filter on indexed columns or aggregate fewer rows, and try again.",  # noqa: E501
+            retry_after_ms=10,
+        ) from e
     except Exception as e:
         raise RetryableToolError(  # noqa: TRY003
             f"Query failed: {e}",
@@ -49,12 +253,16 @@ def execute_query(
             retry_after_ms=10,
         ) from e
 
+    if cache_key is not None:
+        _result_cache.put(cache_key, rows, cache_ttl_seconds)
+    return rows
+
 
 USER_STATUSES = Literal["active", "inactive", "pending", "banned"]
 
 
 @tool(requires_secrets=["DATABASE_CONNECTION_STRING"])
-def update_user_status(
+async def update_user_status(
     context: ToolContext,
     user_id: Annotated[int, "The ID of the user to update"],
     status: Annotated[USER_STATUSES, "The status to update the user to"],
@@ -70,37 +278,511 @@ def update_user_status(
         context.get_secret("DATABASE_CONNECTION_STRING"), isolation_level="READ COMMITTED"
     )
     query = "UPDATE users SET status = :status WHERE id = :id RETURNING id, email, status"
-    return _execute_query(engine, query, params={"id": user_id, "status": status})
+    rows = await _with_timeout(
+        _execute_query(engine, query, params={"id": user_id, "status": status}, commit=True)
+    )
+    invalidate_result_cache(context.get_secret("DATABASE_CONNECTION_STRING"), tables={"users"})
+    return rows
 
 
-def _get_engine(connection_string: str, isolation_level: str = "READ UNCOMMITTED") -> Engine:
+def _get_engine(connection_string: str, isolation_level: str = "READ UNCOMMITTED") -> AsyncEngine:
     """
     Get a connection to the database.
     Note that we build the engine with an isolation level of READ UNCOMMITTED to prevent all writes.
+    Engines are cached, so that their pooled connections are reused across tool calls.
+    Must be called from the event loop the engine will be used in.
     """
-    return create_engine(connection_string, isolation_level=isolation_level)
+    key = (connection_string, isolation_level)
+    loop = asyncio.get_running_loop()
+    with _engines_lock:
+        cached = _engines.get(key)
+        if cached is not None:
+            if cached[0] is loop:
+                return cached[1]
+            # The old loop's connections cannot be closed from this one; they are dropped
+            cached[1].sync_engine.dispose(close=False)
+
+        url = _get_async_url(connection_string)
+        if url.get_backend_name() == "postgresql" and isolation_level == "READ UNCOMMITTED":
+            # PostgreSQL runs READ UNCOMMITTED transactions as READ COMMITTED,
+            # and asyncpg only accepts the isolation levels PostgreSQL really has
+            isolation_level = "READ COMMITTED"
+
+        # Pooled connections cannot be used outside of the loop they were opened in
+        engine = create_async_engine(
+            url,
+            isolation_level=isolation_level,
+            pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=POOL_RECYCLE_SECONDS,
+        )
+        _set_statement_timeout(engine)
+        _engines[key] = (loop, engine)
+        return engine
+
+
+def _get_async_url(connection_string: str) -> URL:
+    url = make_url(connection_string)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS and not url.get_dialect().is_async:
+        url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    if url.get_driver_name() == "asyncpg":
+        url = _get_asyncpg_ssl_url(url)
+    return url
 
 
-def _get_tables(engine: Engine, schema_name: str) -> list[str]:
+def _get_asyncpg_ssl_url(url: URL) -> URL:
+    """Translate libpq's SSL parameters, which asyncpg would reject, into asyncpg's."""
+    file_parameters = sorted(LIBPQ_SSL_FILE_PARAMETERS.intersection(url.query))
+    if file_parameters:
+        error_message = (
+            f"Unsupported connection string parameters: {', '.join(file_parameters)}. "
+            "Set the PGSSLCERT, PGSSLKEY, PGSSLROOTCERT, PGSSLCRL and PGSSLPASSWORD "
+            "environment variables instead."
+        )
+        raise ValueError(error_message)
+
+    ssl_mode = url.query.get("sslmode")
+    if ssl_mode is None:
+        return url
+    if ssl_mode not in ASYNCPG_SSL_MODES:
+        error_message = (
+            f"Unsupported sslmode: {ssl_mode}. Use one of {', '.join(sorted(ASYNCPG_SSL_MODES))}."
+        )
+        raise ValueError(error_message)
+    return url.difference_update_query(["sslmode"]).update_query_dict({"ssl": ssl_mode})
+
+
+def _set_statement_timeout(engine: AsyncEngine) -> None:
+    """Have the database cancel statements which run longer than STATEMENT_TIMEOUT_SECONDS."""
+    command = STATEMENT_TIMEOUT_COMMANDS.get(engine.dialect.name)
+    if command is None or STATEMENT_TIMEOUT_SECONDS <= 0:
+        return
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_statement_timeout(dbapi_connection: Any, _: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute(command.format(milliseconds=int(STATEMENT_TIMEOUT_SECONDS * 1000)))
+        cursor.close()
+
+
+async def _with_timeout(awaitable: Awaitable[T], timeout: float | None = None) -> T:
+    """
+    Wait for a database call, cancelling it after `timeout` (default TOOL_TIMEOUT_SECONDS) seconds.
+    Cancelling the call also cancels the running statement, on drivers which support it.
+    """
+    return await asyncio.wait_for(awaitable, TOOL_TIMEOUT_SECONDS if timeout is None else timeout)
+
+
+async def _run_sync(engine: AsyncEngine, function: Callable[..., T], *args: Any) -> T:
+    """
+    Call `function` with a synchronous facade of a pooled connection, as the first argument.
+    This is how the inspector, which has no asyncio interface, is used.
+    """
+    async with engine.connect() as connection:
+        return await connection.run_sync(function, *args)
+
+
+@atexit.register
+def _dispose_engines() -> None:
+    """Forget every engine, e.g. when the worker shuts down."""
+    with _engines_lock:
+        for _, engine in _engines.values():
+            # The engines' event loops may be gone, so connections are not closed
+            # gracefully; they are closed with the process
+            engine.sync_engine.dispose(close=False)
+        _engines.clear()
+
+
+def _get_tables(connection: Connection, schema_name: str) -> list[str]:
     """Get all the tables in the database"""
-    inspector = inspect(engine)
-    schemas = inspector.get_schema_names()
-    tables = []
-    for schema in schemas:
-        if schema == schema_name:
-            tables.extend(inspector.get_table_names(schema=schema))
-    return tables
+    return _reflect_schema(connection, schema_name).tables
 
 
-def _get_table_schema(engine: Engine, schema_name: str, table_name: str) -> list[str]:
+def _get_table_schema(connection: Connection, schema_name: str, table_name: str) -> list[str]:
     """Get the schema of a table"""
-    inspector = inspect(engine)
-    columns_table = inspector.get_columns(table_name, schema_name)
+    reflection = _reflect_schema(connection, schema_name)
+    columns_table = reflection.columns.get(table_name)
+    if columns_table is None:
+        # The table may have been created since the schema was reflected, or the name may be
+        # wrong; either way, only this table is looked up
+        columns_table = inspect(connection).get_columns(table_name, schema=schema_name)
+        if not columns_table:
+            raise NoSuchTableError(table_name)
+        with _schema_cache_lock:
+            reflection.columns[table_name] = columns_table
     return [f"{column['name']}: {column['type'].python_type.__name__}" for column in columns_table]
 
 
-def _execute_query(engine: Engine, query: str, params: dict[str, Any] | None = None) -> list[str]:
-    """Execute a query and return the results."""
-    with engine.connect() as connection:
-        result = connection.execute(text(query), params)
-        return [str(row) for row in result.fetchall()]
+# Every column of every table in a schema, with its key constraints and the table's estimated
+# row count, in one round trip to the PostgreSQL catalog
+POSTGRES_SCHEMAS_QUERY = """
+SELECT
+    c.relname AS table_name,
+    a.attname AS column_name,
+    format_type(a.atttypid, a.atttypmod) AS data_type,
+    pk.conname IS NOT NULL AS is_primary_key,
+    fk.target AS foreign_key,
+    c.reltuples::bigint AS approximate_rows
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+LEFT JOIN pg_constraint pk
+    ON pk.conrelid = c.oid AND pk.contype = 'p' AND a.attnum = ANY(pk.conkey)
+LEFT JOIN LATERAL (
+    SELECT string_agg(ft.relname || '.' || fa.attname, ', ') AS target
+    FROM pg_constraint con
+    JOIN pg_class ft ON ft.oid = con.confrelid
+    JOIN pg_attribute fa
+        ON fa.attrelid = con.confrelid
+        AND fa.attnum = con.confkey[array_position(con.conkey, a.attnum)]
+    WHERE con.conrelid = c.oid AND con.contype = 'f' AND a.attnum = ANY(con.conkey)
+) fk ON true
+WHERE n.nspname = :schema_name AND c.relkind IN ('r', 'p')
+"""
+
+
+def _get_schemas(
+    connection: Connection, schema_name: str, table_names: list[str] | None = None
+) -> list[str]:
+    """Describe many tables compactly, one line per table."""
+    if connection.dialect.name != "postgresql":
+        return _get_schemas_with_inspector(connection, schema_name, table_names)
+
+    query = POSTGRES_SCHEMAS_QUERY
+    params: dict[str, Any] = {"schema_name": schema_name}
+    if table_names is not None:
+        query += " AND c.relname IN :table_names"
+        params["table_names"] = table_names
+    statement = text(query + " ORDER BY c.relname, a.attnum")
+    if table_names is not None:
+        statement = statement.bindparams(bindparam("table_names", expanding=True))
+
+    tables: dict[str, tuple[int, list[str]]] = {}
+    for row in connection.execute(statement, params):
+        column = f"{row.column_name} {row.data_type}"
+        if row.is_primary_key:
+            column += " PK"
+        if row.foreign_key:
+            column += f" FK -> {row.foreign_key}"
+        tables.setdefault(row.table_name, (row.approximate_rows, []))[1].append(column)
+
+    return [
+        _format_table_schema(table_name, approximate_rows, columns)
+        for table_name, (approximate_rows, columns) in tables.items()
+    ]
+
+
+def _get_schemas_with_inspector(
+    connection: Connection, schema_name: str, table_names: list[str] | None = None
+) -> list[str]:
+    """
+    The same as _get_schemas, for databases without a PostgreSQL catalog.
+    Row counts are unknown.
+    """
+    inspector = inspect(connection)
+    reflection = _reflect_schema(connection, schema_name)
+    primary_keys = inspector.get_multi_pk_constraint(schema=schema_name)
+    foreign_keys = inspector.get_multi_foreign_keys(schema=schema_name)
+
+    schemas = []
+    for table_name in table_names if table_names is not None else reflection.tables:
+        if table_name not in reflection.columns:
+            continue
+        key = (schema_name, table_name)
+        primary_key = primary_keys.get(key)
+        primary_key_columns = primary_key["constrained_columns"] if primary_key else []
+        references = {
+            column: f"{foreign_key['referred_table']}.{referred_column}"
+            for foreign_key in foreign_keys.get(key, [])
+            for column, referred_column in zip(
+                foreign_key["constrained_columns"], foreign_key["referred_columns"], strict=False
+            )
+        }
+
+        columns = []
+        for column in reflection.columns[table_name]:
+            description = f"{column['name']} {column['type']}"
+            if column["name"] in primary_key_columns:
+                description += " PK"
+            if column["name"] in references:
+                description += f" FK -> {references[column['name']]}"
+            columns.append(description)
+        schemas.append(_format_table_schema(table_name, None, columns))
+    return schemas
+
+
+def _format_table_schema(table_name: str, approximate_rows: int | None, columns: list[str]) -> str:
+    # PostgreSQL estimates -1 rows for tables which have never been analyzed
+    rows = "?" if approximate_rows is None or approximate_rows < 0 else f"~{approximate_rows}"
+    return f"{table_name} ({rows} rows): {', '.join(columns)}"
+
+
+def _reflect_schema(connection: Connection, schema_name: str) -> _SchemaReflection:
+    """
+    Reflect every table and column in the schema, reusing the result for SCHEMA_CACHE_TTL_SECONDS.
+    The columns of all tables, views and materialized views are loaded together with a single
+    catalog query.
+    """
+    key = (_get_cache_key(connection.engine.url), schema_name)
+    with _schema_cache_lock:
+        reflection = _schema_cache.get(key)
+    if (
+        reflection is not None
+        and time.monotonic() - reflection.reflected_at < SCHEMA_CACHE_TTL_SECONDS
+    ):
+        return reflection
+
+    inspector = inspect(connection)
+    tables = inspector.get_table_names(schema=schema_name)
+    columns = {
+        table_name: table_columns
+        for (_, table_name), table_columns in inspector.get_multi_columns(
+            schema=schema_name, kind=ObjectKind.ANY
+        ).items()
+    }
+    reflection = _SchemaReflection(tables=tables, columns=columns)
+    with _schema_cache_lock:
+        _schema_cache[key] = reflection
+    return reflection
+
+
+def invalidate_schema_cache(
+    connection_string: str | None = None, schema_name: str | None = None
+) -> None:
+    """
+    Forget reflected schema metadata, so that it is loaded from the database on next use.
+    With no arguments, everything is forgotten.
+    """
+    if connection_string is not None:
+        connection_string = _get_async_url(connection_string).render_as_string(hide_password=False)
+    with _schema_cache_lock:
+        for key in list(_schema_cache):
+            if connection_string not in (None, key[0]) or schema_name not in (None, key[1]):
+                continue
+            del _schema_cache[key]
+
+
+def invalidate_result_cache(
+    connection_string: str | None = None, tables: set[str] | None = None
+) -> None:
+    """
+    Forget cached query results, e.g. after writing to the database.
+    With `tables`, only the results of queries which read from one of those tables are forgotten.
+    With no arguments, everything is forgotten.
+    """
+    _result_cache.invalidate(
+        _get_cache_key(_get_async_url(connection_string)) if connection_string else None,
+        {_normalize_table_name(table) for table in tables} if tables is not None else None,
+    )
+
+
+def _get_cache_key(url: URL) -> str:
+    return url.render_as_string(hide_password=False)
+
+
+# String literals and quoted identifiers, which are left as they are when normalizing a query
+QUOTED_PATTERN = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+TABLE_REFERENCE_PATTERN = re.compile(
+    r"""\b(?:FROM|JOIN)\s+((?:"(?:[^"]|"")*"|\w+)(?:\s*\.\s*(?:"(?:[^"]|"")*"|\w+))*)""",
+    re.IGNORECASE,
+)
+
+
+def _normalize_query(query: str) -> str:
+    """
+    Normalize the text of a query for use as a cache key: runs of whitespace are collapsed.
+    Case is kept, as some databases (e.g. MySQL on Linux) have case-sensitive table names.
+    """
+    parts = QUOTED_PATTERN.split(query.strip().rstrip(";").strip())
+    # Quoted parts are at odd indexes
+    return "".join(
+        part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts)
+    )
+
+
+def _get_query_tables(query: str) -> set[str]:
+    """
+    The tables named after FROM or JOIN in the query, without their schema.
+    Tables read through views or functions are not found.
+    """
+    return {
+        _normalize_table_name(match.group(1)) for match in TABLE_REFERENCE_PATTERN.finditer(query)
+    }
+
+
+def _normalize_table_name(table: str) -> str:
+    name = re.split(r"\s*\.\s*", table)[-1]
+    if name.startswith('"'):
+        return name[1:-1].replace('""', '"')
+    return name.lower()
+
+
+async def _check_and_execute_query(
+    engine: AsyncEngine, query: str, offset: int, result_format: RESULT_FORMATS
+) -> list[str]:
+    """Execute a query from the agent, unless the planner estimates it to be too expensive."""
+    stream = _is_streamable(query)
+    if (MAX_QUERY_COST > 0 or MAX_QUERY_ESTIMATED_ROWS > 0) and stream:
+        await _check_query_cost(engine, query)
+    return await _execute_query(
+        engine, query, offset=offset, stream=stream, result_format=result_format
+    )
+
+
+async def _execute_query(
+    engine: AsyncEngine,
+    query: str,
+    params: dict[str, Any] | None = None,
+    offset: int = 0,
+    stream: bool = False,
+    commit: bool = False,
+    result_format: RESULT_FORMATS = "rows",
+    max_rows: int = MAX_RESULT_ROWS,
+    max_bytes: int = MAX_RESULT_BYTES,
+) -> list[str]:
+    """
+    Execute a query and return the results, starting at the `offset`th row.
+    At most `max_rows` rows and `max_bytes` of text are returned. If there are more rows,
+    a final line gives the offset to continue from.
+    With `stream`, rows are fetched from a server-side cursor in batches rather than all at once,
+    and the query is paged by the database, which skips the first `offset` rows itself.
+    Nothing is committed unless `commit` is set.
+
+    With a `result_format` of "csv", the first line is a header of column names, and each row
+    is a line of CSV written by the csv module straight from the row's values.
+    """
+    rows: list[str] = []
+    size = 0
+    skip = offset
+    if stream:
+        query, params = _page_query(query, params, offset, max_rows + 1)
+        skip = 0
+    async with engine.connect() as connection:
+        async with _open_result(connection, query, params, stream) as (columns, results):
+            if result_format == "csv":
+                writer = csv.writer(_CSVLine(), lineterminator="")
+                format_row: Callable[[Row], str] = writer.writerow
+                if columns:
+                    header = writer.writerow(columns)
+                    rows.append(header)
+                    size += len(header)
+            else:
+                format_row = str
+
+            returned = 0
+            index = 0
+            async for row in results:
+                index += 1
+                if index <= skip:
+                    continue
+                row_text = format_row(row)
+                size += len(row_text)
+                if returned >= max_rows or (returned and size > max_bytes):
+                    next_offset = offset + returned
+                    rows.append(
+                        f"... results truncated after {next_offset} rows."
+                        f" Run the same query with offset={next_offset} to get more."
+                    )
+                    break
+                rows.append(row_text)
+                returned += 1
+        if commit:
+            await connection.commit()
+    return rows
+
+
+def _page_query(
+    query: str, params: dict[str, Any] | None, offset: int, limit: int
+) -> tuple[str, dict[str, Any]]:
+    """
+    Wrap a query which reads rows so that the database returns at most `limit` of its rows,
+    after the first `offset`, instead of the whole result being read and thrown away.
+    """
+    # On lines of their own, so that a comment at the end of the query comments out nothing
+    paged_query = (
+        f"SELECT * FROM (\n{query.strip().rstrip(';')}\n) AS paged_query"  # noqa: S608
+        " LIMIT :page_limit OFFSET :page_offset"
+    )
+    return paged_query, {**(params or {}), "page_limit": limit, "page_offset": offset}
+
+
+class _CSVLine:
+    """A file for csv.writer, which makes writerow() return the line rather than write it."""
+
+    def write(self, line: str) -> str:
+        return line
+
+
+@asynccontextmanager
+async def _open_result(
+    connection: AsyncConnection, query: str, params: dict[str, Any] | None, stream: bool
+) -> AsyncIterator[tuple[list[str], AsyncIterator[Row]]]:
+    """Execute the query, and yield the names of its columns and an iterator of its rows."""
+    if stream:
+        streamed = await connection.stream(
+            text(query), params, execution_options={"max_row_buffer": STREAM_BATCH_SIZE}
+        )
+        try:
+            yield list(streamed.keys()), streamed
+        finally:
+            await streamed.close()
+        return
+
+    result = await connection.execute(text(query), params)
+    try:
+        if result.returns_rows:
+            yield list(result.keys()), _iterate_rows(result)
+        else:
+            yield [], _iterate_rows([])
+    finally:
+        result.close()
+
+
+async def _iterate_rows(rows: Iterable[Row]) -> AsyncIterator[Row]:
+    for row in rows:
+        yield row
+
+
+async def _check_query_cost(engine: AsyncEngine, query: str) -> None:
+    """
+    Ask the database to plan the query without running it, and refuse queries whose estimated
+    cost or number of rows is over MAX_QUERY_COST or MAX_QUERY_ESTIMATED_ROWS.
+    Only PostgreSQL plans are understood; other databases are not checked.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+
+    async with engine.connect() as connection:
+        result = await connection.execute(text(f"EXPLAIN (FORMAT JSON) {query}"))
+        plan = result.scalar_one()[0]["Plan"]
+
+    cost = plan["Total Cost"]
+    rows = plan["Plan Rows"]
+    too_expensive = 0 < MAX_QUERY_COST < cost
+    too_many_rows = 0 < MAX_QUERY_ESTIMATED_ROWS < rows
+    if not too_expensive and not too_many_rows:
+        return
+
+    limit = (
+        f"cost limit of {MAX_QUERY_COST:g}"
+        if too_expensive
+        else f"limit of {MAX_QUERY_ESTIMATED_ROWS:g} rows"
+    )
+    raise RetryableToolError(  # noqa: TRY003
+        f"Query is estimated to cost {cost:g} and return {rows:g} rows, over the {limit}",
+        developer_message=f"Query '{query}' was not run. Its plan is: {plan}",
+        additional_prompt_content=(
+            "Make the query cheaper before trying again: filter on indexed or key columns, "
+            "aggregate in the query instead of returning every row, add a LIMIT, "
+            "and make sure every JOIN has a join condition so tables are not cross joined. "
+            "Use <GetSchemas> to see the tables' keys and sizes."
+        ),
+        retry_after_ms=10,
+    )
+
+
+def _is_streamable(query: str) -> bool:
+    """Server-side cursors can only be opened for queries which read rows."""
+    return re.match(r"\s*(SELECT|WITH|VALUES|TABLE)\b", query, re.IGNORECASE) is not None
@@ -1,11 +1,27 @@
+import asyncio
+
 import pytest
 from arcade.core.schema import ToolSecretItem
 from arcade.sdk import ToolContext
+from arcade.sdk.errors import RetryableToolError, ToolExecutionError
 
 from arcade_sql.tools.sql import (
+    MAX_RESULT_ROWS,
+    STATEMENT_TIMEOUT_SECONDS,
+    _dispose_engines,
+    _engines,
+    _get_async_url,
+    _get_engine,
+    _get_query_tables,
+    _normalize_query,
+    _result_cache,
+    _schema_cache,
     discover_tables,
     execute_query,
+    get_schemas,
     get_table_schema,
+    invalidate_result_cache,
+    invalidate_schema_cache,
     update_user_status,
 )
 
@@ -23,12 +39,12 @@ def mock_context():
     return context
 
 
-def test_discover_tables(mock_context) -> None:
-    assert discover_tables(mock_context) == ["users", "messages"]
+async def test_discover_tables(mock_context) -> None:
+    assert await discover_tables(mock_context) == ["users", "messages"]
 
 
-def test_get_table_schema(mock_context) -> None:
-    assert get_table_schema(mock_context, "public", "users") == [
+async def test_get_table_schema(mock_context) -> None:
+    assert await get_table_schema(mock_context, "public", "users") == [
         "id: int",
         "name: str",
         "email: str",
@@ -39,12 +55,215 @@ def test_get_table_schema(mock_context) -> None:
     ]
 
 
-def test_execute_query(mock_context) -> None:
-    assert execute_query(mock_context, "SELECT id, name, email FROM users WHERE id = 1") == [
+async def test_execute_query(mock_context) -> None:
+    assert await execute_query(mock_context, "SELECT id, name, email FROM users WHERE id = 1") == [
         "(1, 'Mario', 'mario@example.com')"
     ]
 
 
-def test_update_user_status(mock_context) -> None:
-    print(update_user_status(mock_context, 1, "active"))
-    assert update_user_status(mock_context, 1, "active") == ["(1, 'mario@example.com', 'active')"]
+async def test_update_user_status(mock_context) -> None:
+    assert await update_user_status(mock_context, 1, "inactive") == [
+        "(1, 'mario@example.com', 'inactive')"
+    ]
+    try:
+        # The update is committed, so other connections see it
+        assert await execute_query(mock_context, "SELECT status FROM users WHERE id = 1") == [
+            "('inactive',)"
+        ]
+    finally:
+        await update_user_status(mock_context, 1, "active")
+    assert await execute_query(mock_context, "SELECT status FROM users WHERE id = 1") == [
+        "('active',)"
+    ]
+
+
+async def test_engines_are_reused(mock_context) -> None:
+    connection_string = mock_context.get_secret("DATABASE_CONNECTION_STRING")
+    engine = _get_engine(connection_string)
+    assert _get_engine(connection_string) is engine
+    assert _get_engine(connection_string, isolation_level="READ COMMITTED") is not engine
+
+    _dispose_engines()
+    assert _get_engine(connection_string) is not engine
+
+
+async def test_engines_of_other_event_loops_are_disposed(mock_context) -> None:
+    connection_string = mock_context.get_secret("DATABASE_CONNECTION_STRING")
+    engine = _get_engine(connection_string)
+    pool = engine.sync_engine.pool
+    old_loop = asyncio.new_event_loop()
+    try:
+        _engines[(connection_string, "READ UNCOMMITTED")] = (old_loop, engine)
+        assert _get_engine(connection_string) is not engine
+        assert engine.sync_engine.pool is not pool
+    finally:
+        old_loop.close()
+
+
+def test_sslmode_is_passed_to_asyncpg_as_ssl() -> None:
+    url = _get_async_url("postgresql://evan@localhost:5432/postgres?sslmode=require")
+    assert url.drivername == "postgresql+asyncpg"
+    assert dict(url.query) == {"ssl": "require"}
+
+    with pytest.raises(ValueError, match="sslmode"):
+        _get_async_url("postgresql://evan@localhost:5432/postgres?sslmode=bogus")
+    with pytest.raises(ValueError, match="PGSSLROOTCERT"):
+        _get_async_url("postgresql://evan@localhost:5432/postgres?sslrootcert=/tmp/ca.pem")
+
+
+async def test_connection_strings_with_sslmode(mock_context) -> None:
+    connection_string = mock_context.get_secret("DATABASE_CONNECTION_STRING")
+    mock_context.secrets[0].value = f"{connection_string}?sslmode=disable"
+    assert await discover_tables(mock_context) == ["users", "messages"]
+
+
+async def test_execute_query_truncates_large_results(mock_context) -> None:
+    query = "SELECT generate_series(1, 2500)"
+    rows = await execute_query(mock_context, query)
+    assert len(rows) == MAX_RESULT_ROWS + 1
+    assert rows[0] == "(1,)"
+    assert f"offset={MAX_RESULT_ROWS}" in rows[-1]
+
+    rows = await execute_query(mock_context, query, offset=2000)
+    assert len(rows) == 500
+    assert rows[0] == "(2001,)"
+    assert rows[-1] == "(2500,)"
+
+
+async def test_execute_query_pages_in_the_database(mock_context) -> None:
+    query = "SELECT id FROM generate_series(1, 2500) AS id ORDER BY id DESC -- newest first"
+    assert await execute_query(mock_context, query, offset=2490) == [
+        f"({i},)" for i in range(10, 0, -1)
+    ]
+    assert await execute_query(mock_context, "SELECT 1 AS one;", result_format="csv") == [
+        "one",
+        "1",
+    ]
+
+
+async def test_schema_metadata_is_cached(mock_context) -> None:
+    invalidate_schema_cache()
+    assert await discover_tables(mock_context) == ["users", "messages"]
+    assert len(_schema_cache) == 1
+    reflection = next(iter(_schema_cache.values()))
+
+    assert (await get_table_schema(mock_context, "public", "messages"))[0] == "id: int"
+    assert await discover_tables(mock_context) == ["users", "messages"]
+    assert next(iter(_schema_cache.values())) is reflection
+
+    invalidate_schema_cache(schema_name="public")
+    assert len(_schema_cache) == 0
+
+
+async def test_get_table_schema_of_a_view(mock_context) -> None:
+    assert "tablename: str" in await get_table_schema(mock_context, "pg_catalog", "pg_tables")
+
+
+async def test_unknown_tables_do_not_reflect_the_schema_again(mock_context) -> None:
+    invalidate_schema_cache()
+    await discover_tables(mock_context)
+    reflection = next(iter(_schema_cache.values()))
+
+    with pytest.raises(ToolExecutionError):
+        await get_table_schema(mock_context, "public", "user")
+    assert next(iter(_schema_cache.values())) is reflection
+
+
+async def test_get_schemas(mock_context) -> None:
+    schemas = await get_schemas(mock_context, "public", ["users", "messages"])
+    assert len(schemas) == 2
+    messages, users = schemas
+    assert messages.startswith("messages (")
+    assert "id integer PK" in messages
+    assert "user_id integer FK -> users.id" in messages
+    assert users.startswith("users (")
+    assert "email text" in users
+
+    assert len(await get_schemas(mock_context)) == 2
+
+
+async def test_statement_timeout_is_set_on_connections(mock_context) -> None:
+    assert await execute_query(mock_context, "SHOW statement_timeout") == [
+        f"('{STATEMENT_TIMEOUT_SECONDS:g}s',)"
+    ]
+
+
+async def test_slow_queries_are_cancelled(mock_context, monkeypatch) -> None:
+    monkeypatch.setattr("arcade_sql.tools.sql.TOOL_TIMEOUT_SECONDS", 0.5)
+    with pytest.raises(RetryableToolError, match="did not finish"):
+        await execute_query(mock_context, "SELECT pg_sleep(10)")
+
+    # The connection is usable again once the statement has been cancelled
+    assert await execute_query(mock_context, "SELECT 1") == ["(1,)"]
+
+
+async def test_cost_check_and_query_share_the_timeout(mock_context, monkeypatch) -> None:
+    monkeypatch.setattr("arcade_sql.tools.sql.TOOL_TIMEOUT_SECONDS", 0.5)
+    monkeypatch.setattr("arcade_sql.tools.sql.MAX_QUERY_COST", 1e12)
+
+    async def slow_check_query_cost(*args) -> None:
+        await asyncio.sleep(0.4)
+
+    monkeypatch.setattr("arcade_sql.tools.sql._check_query_cost", slow_check_query_cost)
+    with pytest.raises(RetryableToolError, match="did not finish"):
+        await execute_query(mock_context, "SELECT pg_sleep(0.3)")
+
+
+async def test_query_results_are_cached(mock_context, monkeypatch) -> None:
+    invalidate_result_cache()
+    query = "SELECT status FROM users WHERE id = 1"
+    assert await execute_query(mock_context, query) == ["('active',)"]
+    assert len(_result_cache) == 0
+
+    assert await execute_query(mock_context, query, cache_ttl_seconds=60) == ["('active',)"]
+    assert len(_result_cache) == 1
+
+    async def fail(*args, **kwargs):
+        error_message = "The database should not be queried"
+        raise AssertionError(error_message)
+
+    with monkeypatch.context() as m:
+        m.setattr("arcade_sql.tools.sql._execute_query", fail)
+        rows = await execute_query(
+            mock_context, "SELECT  status\nFROM users WHERE id = 1;", cache_ttl_seconds=60
+        )
+        assert rows == ["('active',)"]
+
+    # Writing to the users table invalidates the results of queries which read from it
+    await update_user_status(mock_context, 1, "active")
+    assert len(_result_cache) == 0
+
+
+def test_normalize_query() -> None:
+    assert _normalize_query("  SELECT *\n  FROM Users WHERE name = 'A  B';") == (
+        "SELECT * FROM Users WHERE name = 'A  B'"
+    )
+    assert _normalize_query("SELECT * FROM Users") != _normalize_query("SELECT * FROM users")
+    assert _get_query_tables(
+        'SELECT * FROM public.users u JOIN "Messages" m ON m.user_id = u.id'
+    ) == {"users", "Messages"}
+
+
+async def test_execute_query_as_csv(mock_context) -> None:
+    rows = await execute_query(
+        mock_context,
+        "SELECT id, name, email FROM users WHERE id = 1",
+        result_format="csv",
+    )
+    assert rows == ["id,name,email", "1,Mario,mario@example.com"]
+
+    rows = await execute_query(
+        mock_context, "SELECT generate_series(1, 2500) AS n", result_format="csv"
+    )
+    assert len(rows) == MAX_RESULT_ROWS + 2
+    assert rows[:2] == ["n", "1"]
+    assert f"offset={MAX_RESULT_ROWS}" in rows[-1]
+
+
+async def test_expensive_queries_are_refused(mock_context, monkeypatch) -> None:
+    monkeypatch.setattr("arcade_sql.tools.sql.MAX_QUERY_ESTIMATED_ROWS", 1000)
+    query = "SELECT * FROM users a, users b, messages c"
+    with pytest.raises(RetryableToolError, match="over the limit of 1000 rows"):
+        await execute_query(mock_context, query)
+
+    assert await execute_query(mock_context, "SELECT id FROM users WHERE id = 1") == ["(1,)"]